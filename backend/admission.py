@@ -0,0 +1,178 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable
+
+# Decoded samples are float64 (soundfile's default dtype)
+DECODED_SAMPLE_BYTES = 8
+
+# Peak number of full-length float64 copies each pipeline keeps alive
+# (decoded stereo, mono mix, filtered signal, envelope, smoothed envelope, ...)
+COPY_FACTORS = {
+    "analyze": 4,
+    "slice": 6,
+    "extract_kicks": 8,
+    "ai_remix": 3,
+}
+
+# Block-based effects rendering needs roughly constant memory per file
+EFFECTS_RENDER_BYTES = 32 * 1024 * 1024
+
+
+def _default_budget_bytes() -> int:
+    try:
+        physical = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+        return int(physical * 0.5)
+    except (AttributeError, ValueError, OSError):
+        # Windows has no sysconf
+        return 2048 * 1024 * 1024
+
+
+MEMORY_BUDGET_BYTES = int(os.environ.get("DSAMPLER_MEMORY_BUDGET_MB", 0)) * 1024 * 1024 or _default_budget_bytes()
+MAX_QUEUE_DEPTH = int(os.environ.get("DSAMPLER_ADMISSION_QUEUE", 16))
+QUEUE_TIMEOUT_SECONDS = float(os.environ.get("DSAMPLER_ADMISSION_TIMEOUT", 30))
+
+
+def estimate_file_memory(file_path: str, copy_factor: float) -> int:
+    """
+    Bytes needed to process a file: frames x channels x dtype size x copy factor,
+    read from the file header without decoding it.
+    """
+    import soundfile as sf
+
+    try:
+        info = sf.info(file_path)
+        frames, channels = info.frames, info.channels
+    except Exception:
+        # Unknown header: assume 16-bit PCM-sized input
+        frames, channels = os.path.getsize(file_path) // 2, 1
+    return int(frames * channels * DECODED_SAMPLE_BYTES * copy_factor)
+
+
+def estimate_files_memory(file_paths: Iterable[str], copy_factor: float) -> int:
+    return sum(estimate_file_memory(path, copy_factor) for path in file_paths)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Admits heavy requests only while their estimated memory fits the budget.
+
+    Requests that don't fit wait in a FIFO queue. When the queue is full the
+    request is rejected with 429; when it waits longer than the timeout it is
+    rejected with 503. Both carry a Retry-After hint based on recent
+    processing times. A request larger than the whole budget is admitted
+    alone once everything else has finished.
+    """
+
+    def __init__(self, budget_bytes: int = MEMORY_BUDGET_BYTES, max_queue: int = MAX_QUEUE_DEPTH,
+                 timeout: float = QUEUE_TIMEOUT_SECONDS):
+        self.budget_bytes = budget_bytes
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.in_use_bytes = 0
+        self.active = 0
+        self.admitted_total = 0
+        self.rejected_total = 0
+        self.timed_out_total = 0
+        self._waiters = deque()
+        self._avg_hold_seconds = 1.0
+        self._condition = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        # Created lazily so it binds to the running event loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def _retry_after(self) -> int:
+        backlog = len(self._waiters) + 1
+        return int(min(120, max(1, math.ceil(self._avg_hold_seconds * backlog / max(1, self.active)))))
+
+    def _fits(self, nbytes: int) -> bool:
+        return self.in_use_bytes + nbytes <= self.budget_bytes or self.active == 0
+
+    async def acquire(self, nbytes: int) -> int:
+        """
+        Wait until nbytes fit in the budget. Returns the amount reserved,
+        which must be passed back to release().
+        """
+        nbytes = min(max(0, int(nbytes)), self.budget_bytes)
+        condition = self._get_condition()
+
+        async with condition:
+            if not self._waiters and self._fits(nbytes):
+                self._admit(nbytes)
+                return nbytes
+
+            if len(self._waiters) >= self.max_queue:
+                self.rejected_total += 1
+                raise AdmissionRejected(429, "Server busy, too many queued requests", self._retry_after())
+
+            ticket = object()
+            self._waiters.append(ticket)
+            try:
+                await asyncio.wait_for(
+                    condition.wait_for(lambda: self._waiters[0] is ticket and self._fits(nbytes)),
+                    timeout=self.timeout
+                )
+            except asyncio.TimeoutError:
+                self.timed_out_total += 1
+                raise AdmissionRejected(503, "Server busy, timed out waiting for memory", self._retry_after())
+            finally:
+                self._waiters.remove(ticket)
+                # The next waiter in line may fit now
+                condition.notify_all()
+
+            self._admit(nbytes)
+            return nbytes
+
+    def _admit(self, nbytes: int):
+        self.in_use_bytes += nbytes
+        self.active += 1
+        self.admitted_total += 1
+
+    async def release(self, nbytes: int, held_seconds: float = None):
+        condition = self._get_condition()
+        async with condition:
+            self.in_use_bytes -= nbytes
+            self.active -= 1
+            if held_seconds is not None:
+                self._avg_hold_seconds = 0.8 * self._avg_hold_seconds + 0.2 * held_seconds
+            condition.notify_all()
+
+    @asynccontextmanager
+    async def admit(self, nbytes: int):
+        reserved = await self.acquire(nbytes)
+        start = time.monotonic()
+        try:
+            yield reserved
+        finally:
+            await self.release(reserved, time.monotonic() - start)
+
+    def stats(self) -> Dict:
+        return {
+            "budget_bytes": self.budget_bytes,
+            "in_use_bytes": self.in_use_bytes,
+            "budget_usage": self.in_use_bytes / self.budget_bytes if self.budget_bytes else 0.0,
+            "active": self.active,
+            "queue_depth": len(self._waiters),
+            "max_queue": self.max_queue,
+            "admitted_total": self.admitted_total,
+            "rejected_total": self.rejected_total,
+            "timed_out_total": self.timed_out_total,
+            "avg_hold_seconds": self._avg_hold_seconds,
+        }
+
+
+admission_controller = AdmissionController()
@@ -2,7 +2,42 @@ import numpy as np
 import soundfile as sf
 import scipy.signal
 import os
-from typing import List, Dict, Tuple
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Optional
+from filter_designs import butter_ba
+from file_utils import atomic_output, content_version
+from profiling import span
+
+SLICE_FILE_PATTERN = re.compile(r"^slice_\d+\.wav$")
+
+def list_slice_files(slices_dir: str) -> List[str]:
+    """
+    Slice files of a job, in the order used for slice indices.
+    Derived files (slice_N_kicks.wav, slice_N_fx.wav) are excluded.
+    """
+    return sorted([f for f in os.listdir(slices_dir) if SLICE_FILE_PATTERN.match(f)])
+
+def load_slices(slices_dir: str) -> Tuple[List[np.ndarray], Optional[int]]:
+    """
+    Decode every slice of a job once, as mono arrays.
+    
+    Returns:
+        (slices: List[np.ndarray], sample_rate: int or None if there are no slices)
+    """
+    slices = []
+    sample_rate = None
+    for slice_file in list_slice_files(slices_dir):
+        y, sr = sf.read(os.path.join(slices_dir, slice_file))
+        
+        # Convert to mono
+        if len(y.shape) > 1:
+            y = y.mean(axis=1)
+        
+        if sample_rate is None:
+            sample_rate = sr
+        slices.append(y)
+    return slices, sample_rate
 
 def analyze_slice_features(audio_path: str) -> Dict:
     """
@@ -18,6 +53,25 @@ def analyze_slice_features(audio_path: str) -> Dict:
         if len(y.shape) > 1:
             y = y.mean(axis=1)
         
+        return compute_slice_features(y, sr)
+    except Exception as e:
+        print(f"Error analyzing {audio_path}: {e}")
+        return {
+            "energy": 0.0,
+            "brightness": 0.0,
+            "onset_strength": 0.0,
+            "duration": 0.0
+        }
+
+
+def compute_slice_features(y: np.ndarray, sr: int) -> Dict:
+    """
+    Extract musical features from already decoded mono audio.
+    
+    Returns:
+        dict with keys: energy, brightness, onset_strength, duration
+    """
+    try:
         # Energy (RMS)
         energy = float(np.sqrt(np.mean(y**2)))
         
@@ -28,7 +82,7 @@ def analyze_slice_features(audio_path: str) -> Dict:
         
         # Onset Strength (percussiveness) - envelope derivative
         envelope = np.abs(y)
-        b, a = scipy.signal.butter(2, 10 / (sr/2), 'low')
+        b, a = butter_ba(2, 10, 'low', sr)
         envelope_smooth = scipy.signal.filtfilt(b, a, envelope)
         onset_strength = float(np.mean(np.abs(np.diff(envelope_smooth))))
         
@@ -42,7 +96,7 @@ def analyze_slice_features(audio_path: str) -> Dict:
             "duration": duration
         }
     except Exception as e:
-        print(f"Error analyzing {audio_path}: {e}")
+        print(f"Error analyzing slice: {e}")
         return {
             "energy": 0.0,
             "brightness": 0.0,
@@ -108,7 +162,8 @@ def classify_slices(slices_features: List[Dict]) -> Dict[str, List[int]]:
     return categories
 
 
-def generate_remix_structure(categories: Dict[str, List[int]], bpm: float, target_duration: float = 60.0) -> List[Dict]:
+def generate_remix_structure(categories: Dict[str, List[int]], bpm: float, target_duration: float = 60.0,
+                             rng: Optional[np.random.Generator] = None) -> List[Dict]:
     """
     Generate a remix sequence with musical structure.
     
@@ -121,9 +176,15 @@ def generate_remix_structure(categories: Dict[str, List[int]], bpm: float, targe
     6. Drop (32 beats)
     7. Outro (8-16 beats)
     
+    Args:
+        rng: Random generator; pass a seeded one for a reproducible sequence
+    
     Returns:
         List of dicts: [{"slice_index": int, "repetitions": int}, ...]
     """
+    if rng is None:
+        rng = np.random.default_rng()
+    
     sequence = []
     
     # Helper to add slices with repetition
@@ -137,7 +198,7 @@ def generate_remix_structure(categories: Dict[str, List[int]], bpm: float, targe
             # Select slices (with repetition if needed)
             selected = []
             for _ in range(num_slices):
-                selected.append(int(np.random.choice(available)))  # Convert to native int
+                selected.append(int(rng.choice(available)))  # Convert to native int
             
             for slice_idx in selected:
                 sequence.append({
@@ -157,7 +218,66 @@ def generate_remix_structure(categories: Dict[str, List[int]], bpm: float, targe
     return sequence
 
 
-def render_remix(sequence: List[Dict], slices_dir: str, output_path: str, crossfade_duration: float = 0.05) -> bool:
+def mix_sequence(sequence: List[Dict], slices: List[np.ndarray], sample_rate: int,
+                 crossfade_duration: float = 0.05, max_duration: Optional[float] = None) -> Optional[np.ndarray]:
+    """
+    Concatenate decoded slices following the sequence, with crossfades.
+    The slice arrays are not modified, so they can be shared between variants.
+    
+    Args:
+        max_duration: Stop adding slices once this many seconds are reached (for previews)
+    
+    Returns:
+        Mono audio array, or None if the sequence produced no audio
+    """
+    remix_audio = []
+    total_samples = 0
+    max_samples = int(max_duration * sample_rate) if max_duration else None
+    
+    for item in sequence:
+        slice_idx = item["slice_index"]
+        reps = item["repetitions"]
+        
+        if slice_idx >= len(slices):
+            continue
+        
+        # Repeat the slice
+        for _ in range(reps):
+            remix_audio.append(slices[slice_idx])
+            total_samples += len(slices[slice_idx])
+        
+        if max_samples is not None and total_samples >= max_samples:
+            break
+    
+    if not remix_audio:
+        return None
+    
+    # Concatenate with crossfades
+    final_audio = remix_audio[0].copy()
+    crossfade_samples = int(crossfade_duration * sample_rate)
+    fade_out = np.linspace(1, 0, crossfade_samples)
+    fade_in = np.linspace(0, 1, crossfade_samples)
+    
+    for i in range(1, len(remix_audio)):
+        next_slice = remix_audio[i]
+        
+        if len(final_audio) > crossfade_samples and len(next_slice) > crossfade_samples:
+            # Overlap faded tail and faded head
+            final_audio[-crossfade_samples:] = (final_audio[-crossfade_samples:] * fade_out
+                                                + next_slice[:crossfade_samples] * fade_in)
+            final_audio = np.concatenate([final_audio, next_slice[crossfade_samples:]])
+        else:
+            # No crossfade, just concatenate
+            final_audio = np.concatenate([final_audio, next_slice])
+    
+    if max_samples is not None:
+        final_audio = final_audio[:max_samples]
+    
+    return final_audio
+
+
+def render_remix(sequence: List[Dict], slices_dir: str, output_path: str, crossfade_duration: float = 0.05,
+                 slices: Optional[List[np.ndarray]] = None, sample_rate: Optional[int] = None) -> Optional[str]:
     """
     Render the remix sequence to a WAV file.
     
@@ -166,107 +286,140 @@ def render_remix(sequence: List[Dict], slices_dir: str, output_path: str, crossf
         slices_dir: Directory containing slice_*.wav files
         output_path: Where to save the final remix
         crossfade_duration: Crossfade duration in seconds
+        slices, sample_rate: Already decoded slices (from load_slices); read from slices_dir if omitted
     
     Returns:
-        True if successful, False otherwise
+        Content version of the written remix, None on failure. It is hashed
+        before the rename, so it can't describe another render of the same path.
     """
     try:
-        # Load all slices
-        slice_files = sorted([f for f in os.listdir(slices_dir) if f.startswith("slice_") and f.endswith(".wav")])
+        if slices is None:
+            slices, sample_rate = load_slices(slices_dir)
         
-        if not slice_files:
+        if not slices:
             print("No slices found")
-            return False
+            return None
         
-        # Build the remix
-        remix_audio = []
-        sample_rate = None
+        final_audio = mix_sequence(sequence, slices, sample_rate, crossfade_duration)
         
-        for item in sequence:
-            slice_idx = item["slice_index"]
-            reps = item["repetitions"]
-            
-            if slice_idx >= len(slice_files):
-                continue
-            
-            slice_path = os.path.join(slices_dir, slice_files[slice_idx])
-            y, sr = sf.read(slice_path)
-            
-            # Convert to mono
-            if len(y.shape) > 1:
-                y = y.mean(axis=1)
-            
-            if sample_rate is None:
-                sample_rate = sr
-            
-            # Repeat the slice
-            for _ in range(reps):
-                remix_audio.append(y)
-        
-        if not remix_audio:
+        if final_audio is None:
             print("No audio to render")
-            return False
-        
-        # Concatenate with crossfades
-        final_audio = remix_audio[0]
-        crossfade_samples = int(crossfade_duration * sample_rate)
-        
-        for i in range(1, len(remix_audio)):
-            next_slice = remix_audio[i]
-            
-            if len(final_audio) > crossfade_samples and len(next_slice) > crossfade_samples:
-                # Apply crossfade
-                fade_out = np.linspace(1, 0, crossfade_samples)
-                fade_in = np.linspace(0, 1, crossfade_samples)
-                
-                final_audio[-crossfade_samples:] *= fade_out
-                next_slice[:crossfade_samples] *= fade_in
-                
-                # Overlap
-                final_audio[-crossfade_samples:] += next_slice[:crossfade_samples]
-                final_audio = np.concatenate([final_audio, next_slice[crossfade_samples:]])
-            else:
-                # No crossfade, just concatenate
-                final_audio = np.concatenate([final_audio, next_slice])
+            return None
         
         # Save
-        sf.write(output_path, final_audio, sample_rate)
+        with atomic_output(output_path) as temp_path:
+            sf.write(temp_path, final_audio, sample_rate)
+            version = content_version(temp_path)
         print(f"Remix saved to {output_path}")
-        return True
+        return version
         
     except Exception as e:
         print(f"Error rendering remix: {e}")
+        return None
+
+
+def render_preview(sequence: List[Dict], slices: List[np.ndarray], sample_rate: int, output_path: str,
+                   max_duration: float = 15.0, decimation: int = 4) -> bool:
+    """
+    Render a short, low sample rate preview of a remix sequence.
+    Much cheaper than the full render, so it can be returned first.
+    """
+    try:
+        preview = mix_sequence(sequence, slices, sample_rate, max_duration=max_duration)
+        if preview is None:
+            return False
+        
+        preview = scipy.signal.resample_poly(preview, 1, decimation)
+        with atomic_output(output_path) as temp_path:
+            sf.write(temp_path, preview, sample_rate // decimation)
+        return True
+    except Exception as e:
+        print(f"Error rendering preview: {e}")
         return False
 
 
-def generate_ai_remix(slices_dir: str, bpm: float, output_path: str) -> Tuple[bool, List[Dict], Dict]:
+def variant_rng(seed: int, variant: int) -> np.random.Generator:
     """
-    Main function to generate an AI remix.
+    Independent, reproducible random stream for one variant of a seed.
+    """
+    return np.random.default_rng([seed, variant])
+
+
+def new_seed() -> int:
+    return int(np.random.SeedSequence().entropy % (2**32))
+
+
+def prepare_remix(slices_dir: str) -> Tuple[List[np.ndarray], Optional[int], Dict]:
+    """
+    Decode and classify all slices of a job once, for any number of variants.
     
     Returns:
-        (success: bool, sequence: List[Dict], structure: Dict)
+        (slices: List[np.ndarray], sample_rate: int, categories: Dict)
     """
-    # 1. Analyze all slices
-    slice_files = sorted([f for f in os.listdir(slices_dir) if f.startswith("slice_") and f.endswith(".wav")])
-    
-    if not slice_files:
-        return False, [], {}
+    with span("load_slices"):
+        slices, sample_rate = load_slices(slices_dir)
+    if not slices:
+        return [], None, {}
     
-    print(f"Analyzing {len(slice_files)} slices...")
-    features = []
-    for slice_file in slice_files:
-        slice_path = os.path.join(slices_dir, slice_file)
-        feat = analyze_slice_features(slice_path)
-        features.append(feat)
+    print(f"Analyzing {len(slices)} slices...")
+    with span("slice_features", slices=len(slices)):
+        features = [compute_slice_features(y, sample_rate) for y in slices]
     
-    # 2. Classify slices
     categories = classify_slices(features)
     print(f"Classification: {categories}")
     
+    return slices, sample_rate, categories
+
+
+def variant_sequences(categories: Dict, bpm: float, seed: int, variants: int) -> List[List[Dict]]:
+    """
+    One remix sequence per variant, reproducible from the seed.
+    """
+    return [generate_remix_structure(categories, bpm, rng=variant_rng(seed, k)) for k in range(variants)]
+
+
+def generate_remix_variants(slices: List[np.ndarray], sample_rate: int, categories: Dict, bpm: float,
+                            seed: int, output_paths: List[str], max_workers: Optional[int] = None) -> List[Dict]:
+    """
+    Render one distinct, reproducible remix per output path concurrently.
+    Variant k always produces the same sequence for the same seed.
+    
+    Returns:
+        List of {"variant": int, "sequence": List[Dict], "success": bool, "remix_version": Optional[str]}
+    """
+    sequences = variant_sequences(categories, bpm, seed, len(output_paths))
+    
+    # Threads share the decoded slices; numpy and libsndfile release the GIL
+    with ThreadPoolExecutor(max_workers=max_workers or min(len(output_paths), os.cpu_count() or 1)) as executor:
+        versions = list(executor.map(
+            lambda args: render_remix(args[0], None, args[1], slices=slices, sample_rate=sample_rate),
+            zip(sequences, output_paths)
+        ))
+    
+    return [
+        {"variant": k + 1, "sequence": sequence, "success": version is not None, "remix_version": version}
+        for k, (sequence, version) in enumerate(zip(sequences, versions))
+    ]
+
+
+def generate_ai_remix(slices_dir: str, bpm: float, output_path: str, seed: Optional[int] = None) -> Tuple[bool, List[Dict], Dict]:
+    """
+    Main function to generate an AI remix.
+    
+    Returns:
+        (success: bool, sequence: List[Dict], structure: Dict)
+    """
+    # 1-2. Analyze and classify all slices
+    slices, sample_rate, categories = prepare_remix(slices_dir)
+    
+    if not slices:
+        return False, [], {}
+    
     # 3. Generate structure
-    sequence = generate_remix_structure(categories, bpm)
+    rng = variant_rng(seed, 0) if seed is not None else None
+    sequence = generate_remix_structure(categories, bpm, rng=rng)
     
     # 4. Render
-    success = render_remix(sequence, slices_dir, output_path)
+    success = render_remix(sequence, slices_dir, output_path, slices=slices, sample_rate=sample_rate) is not None
     
     return success, sequence, categories
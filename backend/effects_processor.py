@@ -0,0 +1,316 @@
+import numpy as np
+import os
+import threading
+from concurrent.futures import as_completed
+from functools import lru_cache
+from typing import List, Dict, Optional
+from file_utils import atomic_output
+
+# Frames per block when streaming audio through the effects board.
+# Memory stays constant regardless of file length.
+DEFAULT_BLOCK_SIZE = 8192
+
+# Mirrors the defaults of frontend/src/utils/EffectsChain.js
+DEFAULT_EFFECTS_SETTINGS = {
+    "filter_type": "lowpass",       # 'lowpass', 'highpass', 'bandpass', 'notch'
+    "filter_frequency": 20000.0,    # Hz (fully open by default)
+    "filter_resonance": 1.0,        # Q: 0.1-30
+    "delay_time": 0.25,             # seconds
+    "delay_feedback": 0.4,          # 0-1
+    "delay_mix": 0.3,               # 0-1
+    "reverb_mix": 0.3,              # 0-1
+    "compressor_threshold_db": 0.0, # 0 dB = no compression
+    "compressor_ratio": 1.0,        # 1:1 = no compression
+    "master_volume": 1.0,           # 0-1
+    "bypass": False,
+}
+
+FILTER_TYPES = ("lowpass", "highpass", "bandpass", "notch")
+
+# Same ranges as the browser controls (frontend/src/components/EffectsPanel.jsx)
+MAX_DELAY_SECONDS = 2.0
+FILTER_FREQUENCY_RANGE = (20.0, 20000.0)
+FILTER_RESONANCE_RANGE = (0.1, 30.0)
+
+# Longest delay/reverb tail a render may add, so one request can't hold a worker indefinitely
+MAX_TAIL_SECONDS = 10.0
+
+# pedalboard's Reverb (JUCE) scales its dry and wet levels by these internally
+REVERB_DRY_SCALE = 2.0
+REVERB_WET_SCALE = 3.0
+
+# A chain with no delay/reverb mix and everything else at defaults must leave the level alone
+NEUTRAL_GAIN_TOLERANCE_DB = 0.1
+
+
+def normalize_effects_settings(settings: Optional[Dict] = None) -> Dict:
+    """
+    Merge user settings over the defaults and validate them.
+    Raises ValueError on unknown keys or out-of-range values.
+    """
+    merged = dict(DEFAULT_EFFECTS_SETTINGS)
+    for key, value in (settings or {}).items():
+        if key not in merged:
+            raise ValueError(f"Unknown effect setting: {key}")
+        if value is not None:
+            merged[key] = value
+
+    if merged["filter_type"] not in FILTER_TYPES:
+        raise ValueError(f"filter_type must be one of {', '.join(FILTER_TYPES)}")
+
+    for key in ("filter_frequency", "filter_resonance", "delay_time", "delay_feedback",
+                "delay_mix", "reverb_mix", "compressor_threshold_db", "compressor_ratio",
+                "master_volume"):
+        merged[key] = float(merged[key])
+    merged["bypass"] = bool(merged["bypass"])
+
+    if not 0.0 <= merged["delay_mix"] <= 1.0 or not 0.0 <= merged["reverb_mix"] <= 1.0:
+        raise ValueError("Mix values must be between 0 and 1")
+    if not 0.0 <= merged["delay_feedback"] < 1.0:
+        raise ValueError("delay_feedback must be between 0 and 1")
+    if not 0.0 <= merged["master_volume"] <= 1.0:
+        raise ValueError("master_volume must be between 0 and 1")
+    if merged["compressor_ratio"] < 1.0:
+        raise ValueError("compressor_ratio must be >= 1")
+    if not 0.0 <= merged["delay_time"] <= MAX_DELAY_SECONDS:
+        raise ValueError(f"delay_time must be between 0 and {MAX_DELAY_SECONDS:g} seconds")
+    if not FILTER_FREQUENCY_RANGE[0] <= merged["filter_frequency"] <= FILTER_FREQUENCY_RANGE[1]:
+        raise ValueError("filter_frequency must be between {:g} and {:g} Hz".format(*FILTER_FREQUENCY_RANGE))
+    if not FILTER_RESONANCE_RANGE[0] <= merged["filter_resonance"] <= FILTER_RESONANCE_RANGE[1]:
+        raise ValueError("filter_resonance must be between {:g} and {:g}".format(*FILTER_RESONANCE_RANGE))
+
+    return merged
+
+
+def validate_tail_seconds(tail_seconds: float) -> float:
+    """
+    Raises ValueError unless 0 <= tail_seconds <= MAX_TAIL_SECONDS.
+    """
+    tail_seconds = float(tail_seconds)
+    if not 0.0 <= tail_seconds <= MAX_TAIL_SECONDS:
+        raise ValueError(f"tail_seconds must be between 0 and {MAX_TAIL_SECONDS:g}")
+    return tail_seconds
+
+
+def biquad_sos(filter_type: str, frequency: float, q: float, sample_rate: float) -> np.ndarray:
+    """
+    Coefficients of a Web Audio BiquadFilterNode (Audio EQ Cookbook formulas,
+    as in the Web Audio spec) as one second-order section. Like the browser,
+    lowpass/highpass read Q in dB and bandpass/notch have unity gain at the
+    centre frequency.
+    """
+    w0 = 2 * np.pi * frequency / sample_rate
+    cos_w0, sin_w0 = np.cos(w0), np.sin(w0)
+
+    if filter_type in ("lowpass", "highpass"):
+        alpha = sin_w0 / (2 * 10 ** (q / 20))
+    else:
+        alpha = sin_w0 / (2 * q)
+
+    if filter_type == "lowpass":
+        b = [(1 - cos_w0) / 2, 1 - cos_w0, (1 - cos_w0) / 2]
+    elif filter_type == "highpass":
+        b = [(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2]
+    elif filter_type == "bandpass":
+        b = [alpha, 0.0, -alpha]
+    else:
+        b = [1.0, -2 * cos_w0, 1.0]
+    a = [1 + alpha, -2 * cos_w0, 1 - alpha]
+
+    return np.array([b + a]) / a[0]
+
+
+class BiquadFilter:
+    """
+    Filter stage of the chain. pedalboard has no biquad with the browser's
+    response, so this runs ahead of the board; like a plugin it keeps its
+    state across blocks until reset.
+    """
+
+    def __init__(self, sos: np.ndarray):
+        self.sos = sos
+        self._zi = None
+
+    def reset(self):
+        self._zi = None
+
+    def __call__(self, block: np.ndarray) -> np.ndarray:
+        import scipy.signal
+
+        if self._zi is None:
+            self._zi = np.zeros((len(self.sos),) + block.shape[:-1] + (2,))
+        filtered, self._zi = scipy.signal.sosfilt(self.sos, block, axis=-1, zi=self._zi)
+        return filtered.astype(np.float32)
+
+
+@lru_cache(maxsize=32)
+def _build_board(settings_key: tuple, sample_rate: float):
+    from pedalboard import Pedalboard, Compressor, Delay, Gain, Reverb
+
+    settings = dict(settings_key)
+    volume_db = 20 * np.log10(max(settings["master_volume"], 1e-5))
+
+    if settings["bypass"]:
+        return None, Pedalboard([Gain(gain_db=volume_db)]), threading.Lock()
+
+    # Keep the cutoff safely below Nyquist for low sample rates
+    cutoff = min(settings["filter_frequency"], sample_rate * 0.45)
+    filter_stage = BiquadFilter(biquad_sos(settings["filter_type"], cutoff, settings["filter_resonance"], sample_rate))
+
+    # Same order as the browser chain: filter -> delay -> reverb -> master
+    board = Pedalboard([
+        Delay(
+            delay_seconds=settings["delay_time"],
+            feedback=settings["delay_feedback"],
+            mix=settings["delay_mix"],
+        ),
+        Reverb(
+            room_size=0.5,
+            # Browser gains are dry = 1 - mix, wet = mix
+            wet_level=settings["reverb_mix"] / REVERB_WET_SCALE,
+            dry_level=(1.0 - settings["reverb_mix"]) / REVERB_DRY_SCALE,
+        ),
+        Compressor(
+            threshold_db=settings["compressor_threshold_db"],
+            ratio=settings["compressor_ratio"],
+            attack_ms=5,
+            release_ms=100,
+        ),
+        Gain(gain_db=volume_db),
+    ])
+    # Filter and board hold state, so only one render may use them at a time
+    return filter_stage, board, threading.Lock()
+
+
+def get_effects_board(settings: Dict, sample_rate: float):
+    """
+    Return the cached filter stage (None when bypassed) and Pedalboard graph
+    for these settings and sample rate, with the lock that must be held while
+    rendering through them.
+    """
+    settings_key = tuple(sorted(normalize_effects_settings(settings).items()))
+    return _build_board(settings_key, float(sample_rate))
+
+
+def neutral_chain_gain_db(sample_rate: float = 44100) -> float:
+    """
+    Level change in dB of a 1 kHz sine rendered through the chain with no delay
+    or reverb mix and every other setting at its default. The browser chain is
+    transparent there, so anything beyond NEUTRAL_GAIN_TOLERANCE_DB means the
+    server render no longer matches it.
+    """
+    t = np.arange(int(sample_rate)) / sample_rate
+    block = (0.5 * np.sin(2 * np.pi * 1000 * t)).astype(np.float32)[np.newaxis, :]
+
+    filter_stage, board, board_lock = get_effects_board({"delay_mix": 0.0, "reverb_mix": 0.0}, sample_rate)
+    with board_lock:
+        filter_stage.reset()
+        board.reset()
+        rendered = board(filter_stage(block), sample_rate, reset=False)
+
+    # Skip the first half so filter and compressor settling doesn't count
+    half = block.shape[-1] // 2
+    rms_in = np.sqrt(np.mean(block[:, half:] ** 2))
+    rms_out = np.sqrt(np.mean(rendered[:, half:] ** 2))
+    return float(20 * np.log10(rms_out / rms_in))
+
+
+def render_effects(input_path: str, output_path: str, settings: Optional[Dict] = None,
+                   block_size: int = DEFAULT_BLOCK_SIZE, tail_seconds: float = 0.0) -> Dict:
+    """
+    Render a file through the master effects chain in fixed-size float32 blocks.
+
+    Args:
+        input_path: Slice, remix or recording to process
+        output_path: Where to save the processed WAV
+        settings: Effect settings (see DEFAULT_EFFECTS_SETTINGS)
+        block_size: Frames per processing block
+        tail_seconds: Extra silence rendered after the input to let delay/reverb ring out
+
+    Returns:
+        dict with keys: filename, duration, sample_rate
+    """
+    from pedalboard.io import AudioFile
+
+    tail_seconds = validate_tail_seconds(tail_seconds)
+
+    with AudioFile(input_path) as f:
+        sr = f.samplerate
+        channels = f.num_channels
+        filter_stage, board, board_lock = get_effects_board(settings, sr)
+
+        def process(block):
+            if filter_stage is not None:
+                block = filter_stage(block)
+            return board(block, sr, reset=False)
+
+        with board_lock, atomic_output(output_path) as temp_path, AudioFile(temp_path, "w", sr, channels) as out:
+            # Reset so state from a previous render does not leak in
+            if filter_stage is not None:
+                filter_stage.reset()
+            board.reset()
+            while f.tell() < f.frames:
+                out.write(process(f.read(block_size)))
+
+            tail_frames = int(tail_seconds * sr)
+            silence = np.zeros((channels, block_size), dtype=np.float32)
+            while tail_frames > 0:
+                frames = min(block_size, tail_frames)
+                out.write(process(silence[:, :frames]))
+                tail_frames -= frames
+
+            total_frames = out.frames
+
+    return {
+        "filename": os.path.basename(output_path),
+        "duration": float(total_frames / sr),
+        "sample_rate": int(sr),
+    }
+
+
+def _render_effects_job(input_path: str, output_path: str, settings: Optional[Dict],
+                        block_size: int, tail_seconds: float) -> Dict:
+    try:
+        result = render_effects(input_path, output_path, settings, block_size, tail_seconds)
+        result["source"] = os.path.basename(input_path)
+        result["success"] = True
+        return result
+    except Exception as e:
+        print(f"Error rendering effects for {input_path}: {e}")
+        return {"source": os.path.basename(input_path), "success": False, "error": str(e)}
+
+
+def render_effects_batch(jobs: List[Dict], settings: Optional[Dict] = None,
+                         block_size: int = DEFAULT_BLOCK_SIZE, tail_seconds: float = 0.0) -> List[Dict]:
+    """
+    Render many files through the same effects chain in parallel,
+    using the shared (pre-warmed) process pool.
+
+    Args:
+        jobs: List of {"input_path": str, "output_path": str}
+
+    Returns:
+        One result dict per job, in the same order as jobs.
+        A failing file is reported with success=False instead of aborting the batch.
+    """
+    # Validate once up front so a bad setting fails fast
+    settings = normalize_effects_settings(settings)
+    tail_seconds = validate_tail_seconds(tail_seconds)
+
+    if len(jobs) <= 1:
+        return [_render_effects_job(job["input_path"], job["output_path"], settings, block_size, tail_seconds)
+                for job in jobs]
+
+    from process_pool import get_process_pool
+
+    results = [None] * len(jobs)
+    executor = get_process_pool()
+    futures = {
+        executor.submit(_render_effects_job, job["input_path"], job["output_path"],
+                        settings, block_size, tail_seconds): i
+        for i, job in enumerate(jobs)
+    }
+    for future in as_completed(futures):
+        results[futures[future]] = future.result()
+
+    return results
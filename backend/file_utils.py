@@ -0,0 +1,78 @@
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import BinaryIO
+
+HASH_CHUNK_BYTES = 1024 * 1024
+MAX_CACHED_DIGESTS = 4096
+
+_digests = OrderedDict()
+_digests_lock = threading.Lock()
+
+
+def temp_path_for(path: str) -> str:
+    """
+    Unique sibling path that keeps the extension, since soundfile and
+    pedalboard pick the output format from it.
+    """
+    root, ext = os.path.splitext(path)
+    return f"{root}.tmp-{uuid.uuid4().hex[:8]}{ext}"
+
+
+@contextmanager
+def atomic_output(path: str):
+    """
+    Yield a temporary path to write to; on success it is atomically renamed
+    to path, so readers never see a partially written file. On error the
+    temporary file is removed and path is left untouched.
+    """
+    temp_path = temp_path_for(path)
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def file_version(f: BinaryIO) -> str:
+    """
+    Hash of an open file's content, memoized per file version. An atomic
+    replace (os.replace) or rewrite changes the inode, mtime or size, so a
+    regenerated file is hashed again.
+    """
+    stat = os.fstat(f.fileno())
+    key = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _digests_lock:
+        if key in _digests:
+            _digests.move_to_end(key)
+            return _digests[key]
+
+    digest = hashlib.blake2b(digest_size=16)
+    f.seek(0)
+    for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+        digest.update(chunk)
+    f.seek(0)
+
+    with _digests_lock:
+        _digests[key] = digest.hexdigest()
+        if len(_digests) > MAX_CACHED_DIGESTS:
+            _digests.popitem(last=False)
+    return digest.hexdigest()
+
+
+def content_version(path: str) -> str:
+    """
+    Hash of a file's content, memoized so repeated downloads of an unchanged
+    file don't re-read it.
+
+    Writers sharing an output path should take it from the temporary file
+    inside atomic_output, before the rename: read from path afterwards, it may
+    already be another writer's output. The rename keeps inode and mtime, so
+    the memoized hash is reused when the file is downloaded.
+    """
+    with open(path, "rb") as f:
+        return file_version(f)
@@ -0,0 +1,56 @@
+import scipy.signal
+from functools import lru_cache
+
+
+@lru_cache(maxsize=64)
+def _butter_sos(order: int, band, btype: str, sample_rate: float):
+    return scipy.signal.butter(order, band, btype, fs=sample_rate, output='sos')
+
+
+@lru_cache(maxsize=64)
+def _butter_ba(order: int, band, btype: str, sample_rate: float):
+    return scipy.signal.butter(order, band, btype, fs=sample_rate)
+
+
+@lru_cache(maxsize=16)
+def _savgol_coeffs(window_length: int, polyorder: int):
+    return scipy.signal.savgol_coeffs(window_length, polyorder)
+
+
+def butter_sos(order: int, band, btype: str, sample_rate: float):
+    """
+    Memoized Butterworth design in second-order sections.
+    band is a cutoff in Hz, or a (low, high) tuple for band filters.
+    """
+    # Copy: SciPy's filters need writable coefficients and callers must not alter the cache
+    return _butter_sos(order, band, btype, sample_rate).copy()
+
+
+def butter_ba(order: int, band, btype: str, sample_rate: float):
+    """
+    Memoized Butterworth design as (b, a) coefficients, for filtfilt.
+    """
+    b, a = _butter_ba(order, band, btype, sample_rate)
+    return b.copy(), a.copy()
+
+
+def savgol_coeffs(window_length: int, polyorder: int):
+    """
+    Memoized Savitzky-Golay convolution coefficients.
+    """
+    return _savgol_coeffs(window_length, polyorder).copy()
+
+
+def prime_filter_designs(sample_rates=(44100, 48000)):
+    """
+    Compute the designs used by the processing pipelines ahead of the first request.
+    """
+    from audio_processor import ENVELOPE_SAMPLE_RATE, _smoothing_window
+
+    butter_ba(2, 5, 'low', ENVELOPE_SAMPLE_RATE)
+    for sr in sample_rates:
+        savgol_coeffs(_smoothing_window(sr), 1)
+        butter_sos(6, (20, 150), 'bandpass', sr)
+        butter_sos(8, (20, 150), 'bandpass', sr)
+        butter_sos(8, 150, 'highpass', sr)
+        butter_ba(2, 10, 'low', sr)
@@ -0,0 +1,83 @@
+import mimetypes
+import os
+from email.utils import formatdate
+from typing import BinaryIO, Optional
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+from file_utils import file_version
+
+# Artifacts whose URL identifies their content never change: cache for a year
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Artifacts that can be regenerated in place: cache, but revalidate on every use
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    If-None-Match evaluation (weak comparison, as RFC 9110 requires for it).
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def _iter_file(f: BinaryIO):
+    try:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK_BYTES), b""):
+            yield chunk
+    finally:
+        f.close()
+
+
+def cached_file_response(path: str, if_none_match: Optional[str] = None, immutable: bool = False,
+                         version: Optional[str] = None) -> Response:
+    """
+    File response with a strong content ETag and conditional GET support.
+
+    The file is opened once: the ETag is computed from, and the body streamed
+    from, the same handle, so a regeneration replacing the file in between
+    can't pair new bytes with the old ETag.
+
+    Args:
+        path: File to serve
+        if_none_match: The request's If-None-Match header
+        immutable: The URL always refers to this exact content (e.g. slices of a job)
+        version: Content version the client asked for (?v=); when it matches the
+                 file, the URL is content-addressed and can be cached as immutable
+
+    Returns:
+        304 Not Modified when the client's copy is current, the file otherwise
+    """
+    f = open(path, "rb")
+    try:
+        current = file_version(f)
+        stat = os.fstat(f.fileno())
+    except Exception:
+        f.close()
+        raise
+
+    etag = f'"{current}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable or version == current else REVALIDATE_CACHE_CONTROL,
+    }
+
+    if etag_matches(if_none_match, etag):
+        f.close()
+        return Response(status_code=304, headers=headers)
+
+    headers["Content-Length"] = str(stat.st_size)
+    headers["Last-Modified"] = formatdate(stat.st_mtime, usegmt=True)
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    return StreamingResponse(_iter_file(f), media_type=media_type, headers=headers)
@@ -3,6 +3,9 @@ import soundfile as sf
 import scipy.signal
 from pedalboard import Pedalboard, Compressor, Distortion, HighpassFilter, LowpassFilter, Gain
 import os
+from filter_designs import butter_sos
+from file_utils import atomic_output, content_version, temp_path_for
+from profiling import span
 
 def extract_kicks_only(audio_path, output_path):
     """
@@ -16,11 +19,11 @@ def extract_kicks_only(audio_path, output_path):
         y = y.mean(axis=1)
     
     # Step 1: Isolate kick frequencies (20-150Hz) with very steep filter
-    sos_kicks = scipy.signal.butter(8, [20, 150], 'bandpass', fs=sr, output='sos')
+    sos_kicks = butter_sos(8, (20, 150), 'bandpass', sr)
     kicks_only = scipy.signal.sosfilt(sos_kicks, y)
     
     # Step 2: Remove everything else (high-pass the original to get non-kicks)
-    sos_high = scipy.signal.butter(8, 150, 'highpass', fs=sr, output='sos')
+    sos_high = butter_sos(8, 150, 'highpass', sr)
     non_kicks = scipy.signal.sosfilt(sos_high, y)
     
     # Step 3: Spectral subtraction - subtract non-kicks from original
@@ -43,6 +46,8 @@ def enhance_kicks(audio_path, output_path, enhancement_level=50):
     
     Parameters:
     - enhancement_level: 0-100, controls intensity of enhancement
+    
+    Returns the content version of the written file
     """
     y, sr = sf.read(audio_path)
     
@@ -83,26 +88,32 @@ def enhance_kicks(audio_path, output_path, enhancement_level=50):
     if max_val > 0:
         enhanced = enhanced / max_val * 0.95
     
-    # Save enhanced kicks
-    sf.write(output_path, enhanced, sr)
+    # Save enhanced kicks; versioned before the rename, as another level may be written to the same path
+    with atomic_output(output_path) as temp_path:
+        sf.write(temp_path, enhanced, sr)
+        version = content_version(temp_path)
     
-    return output_path
+    return version
 
 def extract_and_enhance_kicks(audio_path, output_path, enhancement_level=50):
     """
-    Combined function: extract kicks and enhance them in one step
+    Combined function: extract kicks and enhance them in one step.
+    Returns the content version of the written file.
     """
-    # Create temporary file for extracted kicks
-    temp_path = output_path.replace('.wav', '_temp.wav')
-    
-    # Step 1: Extract kicks
-    extract_kicks_only(audio_path, temp_path)
-    
-    # Step 2: Enhance kicks
-    enhance_kicks(temp_path, output_path, enhancement_level)
+    # Create temporary file for extracted kicks (unique, so concurrent runs don't share it)
+    temp_path = temp_path_for(output_path)
     
-    # Clean up temp file
-    if os.path.exists(temp_path):
-        os.remove(temp_path)
-    
-    return output_path
+    try:
+        # Step 1: Extract kicks
+        with span("extract_kicks"):
+            extract_kicks_only(audio_path, temp_path)
+        
+        # Step 2: Enhance kicks
+        with span("enhance_kicks", enhancement_level=enhancement_level):
+            version = enhance_kicks(temp_path, output_path, enhancement_level)
+    finally:
+        # Clean up temp file
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    
+    return version
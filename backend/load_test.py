@@ -0,0 +1,561 @@
+import argparse
+import contextlib
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+import soundfile as sf
+
+# Relative weight of each operation in the request mix
+DEFAULT_MIX = {
+    "analyze": 1,
+    "slice": 1,
+    "extract-kicks": 2,
+    "ai-remix": 1,
+    "download": 8,
+    "download-kicks": 2,
+    "download-remix": 2,
+}
+
+SAMPLE_RATE = 44100
+REQUEST_TIMEOUT_SECONDS = 300
+SAMPLE_INTERVAL_SECONDS = 0.5
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """
+    Parse "slice=1,download=10" into operation weights.
+    Operations left out get weight 0.
+    """
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"Unknown operation '{name}'. Use one of: {', '.join(DEFAULT_MIX)}")
+        mix[name] = float(weight or 1)
+    if sum(mix.values()) <= 0:
+        raise ValueError("The mix needs at least one operation with a positive weight")
+    return mix
+
+
+def synthesize_track(path: str, duration: float, bpm: float, seed: int = 0, sample_rate: int = SAMPLE_RATE):
+    """
+    Write a stereo four-on-the-floor loop (kick, off-beat bass, noise hats)
+    that the analysis and kick pipelines treat like a real track.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(duration * sample_rate)
+    y = np.zeros(n)
+    beat = int(60.0 / bpm * sample_rate)
+
+    t = np.arange(int(0.25 * sample_rate)) / sample_rate
+    kick = np.sin(2 * np.pi * (50 * t + 60 * (1 - np.exp(-t * 30)) / 30)) * np.exp(-t * 12)
+    bass = 0.4 * np.sin(2 * np.pi * 55 * t) * np.exp(-t * 6)
+    hat = 0.15 * rng.standard_normal(int(0.03 * sample_rate)) * np.exp(-np.arange(int(0.03 * sample_rate)) / 200)
+
+    for start in range(0, n, beat):
+        for sound, offset in ((kick, 0), (bass, beat // 2), (hat, beat // 2)):
+            pos = start + offset
+            end = min(n, pos + len(sound))
+            if pos < n:
+                y[pos:end] += sound[:end - pos]
+
+    y = 0.8 * y / np.max(np.abs(y))
+    sf.write(path, np.column_stack([y, y]), sample_rate)
+
+
+def encode_multipart(field: str, filename: str, data: bytes):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f"Content-Type: audio/wav\r\n\r\n"
+    ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+class LoadClient:
+    """
+    Keep-alive HTTP client for one virtual user (http.client connections are
+    not thread-safe, so every user thread has its own).
+    """
+
+    def __init__(self, base_url: str):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.connection = None
+
+    def request(self, method: str, path: str, params: Optional[Dict] = None, upload=None):
+        """
+        Returns (status, body). Connection errors raise.
+        """
+        if params:
+            path = f"{path}?{urlencode(params)}"
+        headers, body = {}, None
+        if upload is not None:
+            body, headers["Content-Type"] = encode_multipart(*upload)
+
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=REQUEST_TIMEOUT_SECONDS)
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            return response.status, response.read()
+        except Exception:
+            # Start over with a fresh connection next time
+            self.close()
+            raise
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class Fixture:
+    """
+    Synthetic tracks plus the server-side state the operations need:
+    uploaded files, a sliced job with kicks extracted and a remix.
+    """
+
+    def __init__(self, track_paths: List[str], bpm: float):
+        self.bpm = bpm
+        self.tracks = [(os.path.basename(p), open(p, "rb").read()) for p in track_paths]
+        self.uploads = []
+        self.job_id = None
+        self.slices = []
+
+    def setup(self, client: LoadClient):
+        for name, data in self.tracks:
+            status, body = client.request("POST", "/analyze", upload=("file", name, data))
+            if status != 200:
+                raise RuntimeError(f"Setup: /analyze failed with {status}: {body[:200]}")
+            self.uploads.append(json.loads(body)["filename"])
+
+        status, body = client.request("POST", "/slice", {
+            "filename": self.uploads[0], "bpm": self.bpm, "time_signature": "4/4"
+        })
+        if status != 200:
+            raise RuntimeError(f"Setup: /slice failed with {status}: {body[:200]}")
+        result = json.loads(body)
+        self.job_id = result["job_id"]
+        self.slices = [s["filename"] for s in result["slices"]]
+
+        steps = [
+            ("/extract-kicks", {"job_id": self.job_id, "filename": self.slices[0]}),
+            ("/ai-remix", {"job_id": self.job_id, "bpm": self.bpm, "seed": 1}),
+        ]
+        for path, params in steps:
+            status, body = client.request("POST", path, params)
+            if status != 200:
+                raise RuntimeError(f"Setup: {path} failed with {status}: {body[:200]}")
+
+    def operation(self, name: str, rng: random.Random):
+        """
+        Build (method, path, params, upload) for one request. Parameters are
+        randomized so concurrent requests are distinct and not coalesced.
+        """
+        if name == "analyze":
+            track_name, data = rng.choice(self.tracks)
+            return "POST", "/analyze", None, ("file", track_name, data)
+        if name == "slice":
+            return "POST", "/slice", {
+                "filename": rng.choice(self.uploads),
+                "bpm": self.bpm,
+                "time_signature": "4/4",
+                "measures_per_slice": rng.choice([0.5, 1, 2, 4]),
+                "kick_offset": rng.randint(0, 50),
+            }, None
+        if name == "extract-kicks":
+            return "POST", "/extract-kicks", {
+                "job_id": self.job_id,
+                "filename": rng.choice(self.slices),
+                "enhancement_level": rng.randint(0, 100),
+            }, None
+        if name == "ai-remix":
+            return "POST", "/ai-remix", {"job_id": self.job_id, "bpm": self.bpm, "seed": rng.randint(0, 2**31)}, None
+        if name == "download":
+            return "GET", f"/download/{self.job_id}/{rng.choice(self.slices)}", None, None
+        if name == "download-kicks":
+            return "GET", f"/download-kicks/{self.job_id}/{self.slices[0]}", None, None
+        if name == "download-remix":
+            return "GET", f"/download-remix/{self.job_id}", None, None
+        raise ValueError(f"Unknown operation: {name}")
+
+
+def _proc_children(pid: int) -> List[int]:
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces, so split after its closing parenthesis
+                fields = f.read().rsplit(")", 1)[1].split()
+            if int(fields[1]) == pid:
+                children.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return children
+
+
+def _proc_usage(pid: int):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    with open(f"/proc/{pid}/statm") as f:
+        rss_bytes = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    return cpu_seconds, rss_bytes
+
+
+def read_process_usage(pid: int):
+    """
+    (cpu_seconds, rss_bytes) of a server process and its children (process
+    pool workers), or None when it cannot be measured on this platform.
+    Uses psutil when installed, /proc otherwise.
+    """
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+
+    try:
+        if psutil is not None:
+            proc = psutil.Process(pid)
+            procs = [proc] + proc.children(recursive=True)
+            cpu_seconds, rss_bytes = 0.0, 0
+            for p in procs:
+                with contextlib.suppress(psutil.Error):
+                    times = p.cpu_times()
+                    cpu_seconds += times.user + times.system
+                    rss_bytes += p.memory_info().rss
+            return cpu_seconds, rss_bytes
+
+        if not os.path.isdir("/proc"):
+            return None
+        cpu_seconds, rss_bytes = _proc_usage(pid)
+        for child in _proc_children(pid):
+            with contextlib.suppress(OSError, IndexError, ValueError):
+                child_cpu, child_rss = _proc_usage(child)
+                cpu_seconds += child_cpu
+                rss_bytes += child_rss
+        return cpu_seconds, rss_bytes
+    except Exception:
+        return None
+
+
+class ResourceSampler(threading.Thread):
+    """
+    Samples CPU utilization and RSS of the server process in the background.
+    """
+
+    def __init__(self, pid: int, interval: float = SAMPLE_INTERVAL_SECONDS):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        start = time.monotonic()
+        previous = read_process_usage(self.pid)
+        previous_time = start
+        while previous is not None and not self._stop_event.wait(self.interval):
+            usage = read_process_usage(self.pid)
+            if usage is None:
+                break
+            now = time.monotonic()
+            self.samples.append({
+                "t": round(now - start, 3),
+                "cpu_percent": round(100 * (usage[0] - previous[0]) / (now - previous_time), 1),
+                "rss_mb": round(usage[1] / 1e6, 1),
+            })
+            previous, previous_time = usage, now
+
+    def stop(self) -> Optional[Dict]:
+        self._stop_event.set()
+        self.join()
+        if not self.samples:
+            return None
+        cpu = [s["cpu_percent"] for s in self.samples]
+        rss = [s["rss_mb"] for s in self.samples]
+        return {
+            "pid": self.pid,
+            "cpu_percent_mean": round(float(np.mean(cpu)), 1),
+            "cpu_percent_max": round(float(np.max(cpu)), 1),
+            "rss_mb_mean": round(float(np.mean(rss)), 1),
+            "rss_mb_peak": round(float(np.max(rss)), 1),
+            "samples": self.samples,
+        }
+
+
+def run_user(base_url: str, fixture: Fixture, mix: Dict[str, float], deadline: float,
+             think_time: float, seed: int, records: List):
+    """
+    One virtual user: pick an operation from the mix, send it, wait for the
+    response, think, repeat until the deadline.
+    """
+    rng = random.Random(seed)
+    client = LoadClient(base_url)
+    names = [name for name, weight in mix.items() if weight > 0]
+    weights = [mix[name] for name in names]
+
+    while time.monotonic() < deadline:
+        name = rng.choices(names, weights)[0]
+        method, path, params, upload = fixture.operation(name, rng)
+        start = time.perf_counter()
+        try:
+            status, body = client.request(method, path, params, upload)
+            error = None if status < 400 else body[:200].decode(errors="replace")
+        except Exception as e:
+            status, body, error = 0, b"", f"{type(e).__name__}: {e}"
+        records.append((name, status, time.perf_counter() - start, len(body), error))
+
+        if think_time > 0:
+            time.sleep(rng.expovariate(1.0 / think_time))
+
+    client.close()
+
+
+def summarize(records: List, wall_seconds: float) -> Dict:
+    """
+    Per-operation throughput, latency percentiles and error rates.
+    """
+    def stats(rows):
+        latencies = np.array([row[2] for row in rows]) * 1000
+        errors = [row for row in rows if row[4] is not None]
+        status_codes = {}
+        for row in rows:
+            status_codes[str(row[1])] = status_codes.get(str(row[1]), 0) + 1
+        return {
+            "requests": len(rows),
+            "errors": len(errors),
+            "error_rate": round(len(errors) / len(rows), 4),
+            "throughput_rps": round(len(rows) / wall_seconds, 3),
+            "latency_ms": {
+                "mean": round(float(latencies.mean()), 1),
+                "p50": round(float(np.percentile(latencies, 50)), 1),
+                "p95": round(float(np.percentile(latencies, 95)), 1),
+                "p99": round(float(np.percentile(latencies, 99)), 1),
+                "max": round(float(latencies.max()), 1),
+            },
+            "status_codes": status_codes,
+            "bytes_received": sum(row[3] for row in rows),
+            "sample_errors": sorted({row[4] for row in errors})[:5],
+        }
+
+    endpoints = {}
+    for name in DEFAULT_MIX:
+        rows = [row for row in records if row[0] == name]
+        if rows:
+            endpoints[name] = stats(rows)
+
+    return {
+        "total": stats(records) if records else None,
+        "endpoints": endpoints,
+    }
+
+
+def start_in_process_server(workdir: str):
+    """
+    Serve main.app with uvicorn on an ephemeral localhost port from a
+    background thread of this process, with uploads/outputs under workdir.
+
+    Returns:
+        (server, thread, base_url)
+    """
+    import uvicorn
+
+    os.chdir(workdir)
+    import main
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(main.app, log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("In-process server failed to start")
+        time.sleep(0.05)
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+def compare_results(result: Dict, baseline: Dict):
+    print(f"\nCompared with {baseline.get('started_at', 'baseline')}:")
+    print(f"{'endpoint':<16}{'rps':>18}{'p95 ms':>22}{'error rate':>20}")
+    for name, current in result["summary"]["endpoints"].items():
+        previous = baseline.get("summary", {}).get("endpoints", {}).get(name)
+        if previous is None:
+            continue
+        print(f"{name:<16}"
+              f"{previous['throughput_rps']:>8.2f} -> {current['throughput_rps']:<7.2f}"
+              f"{previous['latency_ms']['p95']:>10.0f} -> {current['latency_ms']['p95']:<9.0f}"
+              f"{previous['error_rate']:>9.1%} -> {current['error_rate']:<7.1%}")
+
+
+def print_report(result: Dict):
+    summary = result["summary"]
+    print(f"\n{result['config']['users']} users, {result['wall_seconds']:.1f}s, "
+          f"{summary['total']['requests'] if summary['total'] else 0} requests")
+    print(f"{'endpoint':<16}{'reqs':>7}{'rps':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>9}")
+    for name, s in summary["endpoints"].items():
+        print(f"{name:<16}{s['requests']:>7}{s['throughput_rps']:>8.2f}{s['latency_ms']['p50']:>10.0f}"
+              f"{s['latency_ms']['p95']:>10.0f}{s['latency_ms']['p99']:>10.0f}{s['error_rate']:>9.1%}")
+
+    resources = result["resources"]
+    if resources:
+        print(f"Server CPU mean {resources['cpu_percent_mean']}% (max {resources['cpu_percent_max']}%), "
+              f"RSS mean {resources['rss_mb_mean']} MB (peak {resources['rss_mb_peak']} MB)")
+    else:
+        print("Server CPU/RSS not available (use --pid with a local server, or install psutil)")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test the dsampler backend with synthetic audio. Without --url the app "
+                    "is served in-process on a random localhost port; no external network is used."
+    )
+    parser.add_argument("--url", help="Base URL of a running server, e.g. http://localhost:8005")
+    parser.add_argument("--pid", type=int, help="PID of the server given by --url, to sample its CPU and RSS")
+    parser.add_argument("--users", type=int, default=4, help="Concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of load after setup")
+    parser.add_argument("--mix", default=None,
+                        help="Operation weights, e.g. 'slice=1,download=10' "
+                             f"(default: {','.join(f'{k}={v}' for k, v in DEFAULT_MIX.items())})")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean pause between requests per user (s)")
+    parser.add_argument("--tracks", type=int, default=2, help="Synthetic tracks to generate")
+    parser.add_argument("--track-seconds", type=float, default=20, help="Length of each synthetic track")
+    parser.add_argument("--bpm", type=float, default=124)
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the request sequence")
+    parser.add_argument("--workdir", help="Directory for the in-process server's uploads/outputs (default: temp)")
+    parser.add_argument("--output", help="JSON results file (default: loadtest-<timestamp>.json)")
+    parser.add_argument("--compare", help="Previous results JSON to compare against")
+    parser.add_argument("--verbose", action="store_true", help="Show the in-process server's output")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix) if args.mix else dict(DEFAULT_MIX)
+    output_path = os.path.abspath(args.output or f"loadtest-{datetime.now():%Y%m%d-%H%M%S}.json")
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+
+    audio_dir = tempfile.mkdtemp(prefix="dsampler-load-audio-")
+    track_paths = []
+    for k in range(args.tracks):
+        path = os.path.join(audio_dir, f"synthetic_{k + 1}.wav")
+        synthesize_track(path, args.track_seconds, args.bpm, seed=k)
+        track_paths.append(path)
+
+    cleanup_dirs = [audio_dir]
+    server = None
+    previous_cwd = os.getcwd()
+    # In-process, the server's prints would drown the report
+    quiet = args.url is None and not args.verbose
+    server_output = open(os.devnull, "w") if quiet else sys.stdout
+
+    try:
+        with contextlib.redirect_stdout(server_output):
+            if args.url:
+                base_url = args.url.rstrip("/")
+                pid = args.pid
+            else:
+                workdir = args.workdir or tempfile.mkdtemp(prefix="dsampler-load-")
+                if not args.workdir:
+                    cleanup_dirs.append(workdir)
+                print(f"Starting in-process server in {workdir}", file=sys.stderr)
+                server, server_thread, base_url = start_in_process_server(workdir)
+                pid = os.getpid()
+
+            print(f"Setting up fixtures against {base_url}", file=sys.stderr)
+            fixture = Fixture(track_paths, args.bpm)
+            setup_client = LoadClient(base_url)
+            fixture.setup(setup_client)
+            setup_client.close()
+
+            sampler = ResourceSampler(pid) if pid else None
+            if sampler:
+                sampler.start()
+
+            print(f"Running {args.users} users for {args.duration:.0f}s", file=sys.stderr)
+            records = []
+            started_at = datetime.now().isoformat(timespec="seconds")
+            start = time.monotonic()
+            deadline = start + args.duration
+            users = [
+                threading.Thread(target=run_user, args=(base_url, fixture, mix, deadline, args.think_time,
+                                                        args.seed * 1000 + k, records))
+                for k in range(args.users)
+            ]
+            for user in users:
+                user.start()
+            for user in users:
+                user.join()
+            # Requests still running at the deadline are included, so measure to the last response
+            wall_seconds = time.monotonic() - start
+            resources = sampler.stop() if sampler else None
+    finally:
+        if server is not None:
+            # Let the shutdown event stop the process pool before the workdir goes away
+            server.should_exit = True
+            server_thread.join(timeout=30)
+        os.chdir(previous_cwd)
+        if quiet:
+            server_output.close()
+        for path in cleanup_dirs:
+            shutil.rmtree(path, ignore_errors=True)
+
+    result = {
+        "started_at": started_at,
+        "wall_seconds": round(wall_seconds, 3),
+        "config": {
+            "target": args.url or "in-process",
+            # In-process, the sampled CPU and RSS include the load generator itself
+            "resources_include_load_generator": args.url is None,
+            "users": args.users,
+            "duration": args.duration,
+            "think_time": args.think_time,
+            "mix": mix,
+            "tracks": args.tracks,
+            "track_seconds": args.track_seconds,
+            "bpm": args.bpm,
+            "seed": args.seed,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "summary": summarize(records, wall_seconds),
+        "resources": resources,
+    }
+
+    with open(output_path, "w") as f:
+        json.dump(result, f, indent=2)
+
+    print_report(result)
+    print(f"Results saved to {output_path}")
+
+    if compare_path:
+        with open(compare_path) as f:
+            compare_results(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,27 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from typing import List, Optional
+import asyncio
+import json
 import shutil
 import os
+import re
+import time
 import uuid
-from audio_processor import analyze_audio, slice_audio
-from ai_remixer import generate_ai_remix
+from process_pool import MAX_WORKERS, get_process_pool, reset_process_pool, shutdown_process_pool
+from warmup import WARMUP_ENABLED, prime_process_pool, warm_up
+from single_flight import SingleFlight, file_identity
+from admission import (COPY_FACTORS, EFFECTS_RENDER_BYTES, AdmissionRejected, admission_controller,
+                       estimate_file_memory, estimate_files_memory)
+from http_cache import cached_file_response
+from profiling import (PROFILE_FILES, PROFILE_HEADER, PROFILE_QUERY_PARAM, PROFILING_ENABLED,
+                       diagnostics_authorized, list_profiles, profile_dir, profiling_requested, record_span,
+                       run_profiled, save_profile, start_profile, stop_profile)
 
 app = FastAPI()
 
@@ -24,17 +40,161 @@ OUTPUT_DIR = "outputs"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# Batch analysis limits
+MAX_BATCH_FILES = 500
+DEFAULT_BATCH_CONCURRENCY = 4
+
+# Slicing sweep limit (measures x offsets)
+MAX_SWEEP_COMBINATIONS = 32
+
+# AI remix variants per request
+MAX_REMIX_VARIANTS = 8
+
+# Concurrent identical /slice, /extract-kicks and /ai-remix requests share one computation
+single_flight = SingleFlight()
+
+# Job ids are the uuids generated by /slice; anything else (absolute paths, "..") is rejected
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+# Recordings uploaded to /render-effects are kept only with these extensions
+RECORDING_EXTENSIONS = {".wav", ".flac", ".ogg", ".mp3", ".aiff", ".aif"}
+
+# Slices are written once into a fresh job directory, so their URL always means the same content
+SLICE_FILENAME_PATTERN = re.compile(r"^slice_\d+\.wav$")
+
+# Endpoints that can be profiled on demand (see profiling.py)
+PROFILED_PATHS = {"/analyze", "/analyze-batch", "/slice", "/slice-sweep", "/extract-kicks", "/ai-remix",
+                  "/render-effects"}
+
+# Similarity indexing runs off the response path, one job at a time
+index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slice-index")
+
+def index_job(job_id, slices_dir, descriptors=None, only_missing=False):
+    """
+    Add a job's slices to the similarity index. Indexing is best-effort and
+    never fails the request that produced the slices.
+    """
+    try:
+        from slice_index import index_job_slices
+        index_job_slices(job_id, slices_dir, descriptors, only_missing)
+    except Exception as e:
+        print(f"Indexing slices of job {job_id} failed: {e}")
+
+def schedule_indexing(job_id, slices_dir, descriptors=None, only_missing=False):
+    """
+    Index a job's slices in the background; the response doesn't wait for it.
+    descriptors come from slice_index.describe_slices, computed while the request
+    was still admitted: the queue must not hold decoded audio the memory budget
+    no longer counts.
+    """
+    index_executor.submit(index_job, job_id, slices_dir, descriptors, only_missing)
+
+def check_slice_length(bpm, time_signature, measures_per_slice):
+    """
+    Reject slicing parameters that give slices of zero or negative length;
+    the slicer would never advance past them.
+    """
+    if bpm <= 0 or any(measures <= 0 for measures in measures_per_slice):
+        raise HTTPException(status_code=400, detail="bpm and measures_per_slice must be positive")
+    numerator = time_signature.split('/')[0]
+    if numerator.strip().lstrip('-').isdigit() and int(numerator) <= 0:
+        raise HTTPException(status_code=400, detail="Time signature must have at least one beat per measure")
+
+def save_upload(upload, file_path):
+    """
+    Copy an uploaded file to disk. Blocking: call it through run_in_threadpool
+    so large uploads don't stall the event loop.
+    """
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(upload.file, buffer)
+
+@asynccontextmanager
+async def admitted(nbytes):
+    """
+    Hold a share of the memory budget while a heavy request runs.
+    Rejections become 429/503 responses with a Retry-After header.
+    """
+    wait_start = time.perf_counter()
+    try:
+        async with admission_controller.admit(nbytes):
+            record_span("admission_wait", wait_start, bytes=nbytes)
+            yield
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail,
+                            headers={"Retry-After": str(e.retry_after)})
+
+async def profile_requests(request: Request, call_next):
+    """
+    Profile a processing request when it carries the X-Profile header or
+    ?profile= query param and profiling is enabled (DSAMPLER_PROFILING=1).
+    The profile is saved once the response body has been sent; its id is
+    returned in the X-Profile-Id header.
+    """
+    flag = request.headers.get(PROFILE_HEADER) or request.query_params.get(PROFILE_QUERY_PARAM)
+    if request.url.path not in PROFILED_PATHS or not profiling_requested(flag):
+        return await call_next(request)
+
+    profile, token = start_profile(request.method, request.url.path)
+    try:
+        response = await call_next(request)
+    finally:
+        stop_profile(token)
+
+    body = response.body_iterator
+
+    async def body_then_save():
+        # Streaming endpoints keep working after call_next returns
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            profile.finish(response.status_code)
+            try:
+                await run_in_threadpool(save_profile, profile)
+            except Exception as e:
+                print(f"Saving profile {profile.profile_id} failed: {e}")
+
+    response.body_iterator = body_then_save()
+    response.headers["X-Profile-Id"] = profile.profile_id
+    return response
+
+# The middleware wraps every request, so it is only installed when profiling can be used
+if PROFILING_ENABLED:
+    app.middleware("http")(profile_requests)
+
+@app.on_event("startup")
+async def startup_event():
+    """
+    Warm up before accepting traffic: preload the processing modules, prime
+    the filter-design cache and start the process pool workers.
+    """
+    if not WARMUP_ENABLED:
+        return
+    try:
+        timings = await run_in_threadpool(warm_up)
+        workers = await run_in_threadpool(prime_process_pool, get_process_pool(), MAX_WORKERS)
+        print(f"Warm-up done: {timings}, {workers} pool workers ready")
+    except Exception as e:
+        # A failed warm-up only costs latency on the first requests
+        print(f"Warm-up failed: {e}")
+
+@app.on_event("shutdown")
+def shutdown_event():
+    shutdown_process_pool()
+
 @app.post("/analyze")
 async def analyze_endpoint(file: UploadFile = File(...)):
     try:
+        from audio_processor import analyze_audio
+
         file_ext = os.path.splitext(file.filename)[1]
         filename = f"{uuid.uuid4()}{file_ext}"
         file_path = os.path.join(UPLOAD_DIR, filename)
 
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        await run_in_threadpool(save_upload, file, file_path)
 
-        analysis_result = analyze_audio(file_path)
+        async with admitted(estimate_file_memory(file_path, COPY_FACTORS["analyze"])):
+            analysis_result = await run_profiled(analyze_audio, file_path)
         
         return {
             "filename": filename,
@@ -44,45 +204,261 @@ async def analyze_endpoint(file: UploadFile = File(...)):
             "key": analysis_result["key"],
             "kick_recommendation": analysis_result["kick_recommendation"]
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/analyze-batch")
+async def analyze_batch_endpoint(
+    files: List[UploadFile] = File(None),
+    filenames: List[str] = Query([]),
+    concurrency: int = DEFAULT_BATCH_CONCURRENCY
+):
+    """
+    Analyze many tracks in parallel. Accepts new uploads and/or filenames
+    returned by earlier /analyze calls, and streams one NDJSON line per track
+    as soon as it finishes. A track that fails to analyze is reported in its
+    own line without affecting the rest of the batch.
+    """
+    entries = []
+    for name in filenames:
+        filename = os.path.basename(name)
+        entries.append({"filename": filename, "original_filename": name,
+                        "file_path": os.path.join(UPLOAD_DIR, filename)})
+
+    if len(entries) + len(files or []) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"Too many files (max {MAX_BATCH_FILES} per batch)")
+
+    # Uploads are stored before streaming starts, so they can be sliced later like /analyze
+    for upload in files or []:
+        file_ext = os.path.splitext(upload.filename)[1]
+        filename = f"{uuid.uuid4()}{file_ext}"
+        file_path = os.path.join(UPLOAD_DIR, filename)
+        await run_in_threadpool(save_upload, upload, file_path)
+        entries.append({"filename": filename, "original_filename": upload.filename,
+                        "file_path": file_path})
+
+    if not entries:
+        raise HTTPException(status_code=400, detail="No files to analyze")
+
+    concurrency = max(1, min(int(concurrency), MAX_WORKERS))
+    from audio_processor import analyze_audio
+
+    async def analyze_isolated(loop, file_path):
+        isolated = ProcessPoolExecutor(max_workers=1)
+        try:
+            return await loop.run_in_executor(isolated, analyze_audio, file_path)
+        finally:
+            isolated.shutdown(wait=False)
+
+    async def analyze_entry(index, entry, semaphore):
+        line = {"index": index, "filename": entry["filename"],
+                "original_filename": entry["original_filename"]}
+        if not os.path.exists(entry["file_path"]):
+            line.update({"success": False, "error": "File not found"})
+            return line
+
+        async with semaphore:
+            loop = asyncio.get_running_loop()
+            try:
+                nbytes = estimate_file_memory(entry["file_path"], COPY_FACTORS["analyze"])
+                async with admission_controller.admit(nbytes):
+                    pool = get_process_pool()
+                    try:
+                        result = await loop.run_in_executor(pool, analyze_audio, entry["file_path"])
+                    except BrokenProcessPool:
+                        # A worker died (e.g. crashed decoder) and took every track on the pool down
+                        # with it. Replace the pool, then retry this track alone so only the file
+                        # that really crashes is blamed.
+                        reset_process_pool(pool)
+                        result = await analyze_isolated(loop, entry["file_path"])
+            except AdmissionRejected as e:
+                line.update({"success": False, "error": e.detail, "retry_after": e.retry_after})
+                return line
+            except BrokenProcessPool:
+                line.update({"success": False, "error": "Worker crashed while analyzing this file"})
+                return line
+            except Exception as e:
+                line.update({"success": False, "error": str(e)})
+                return line
+
+        line.update({
+            "success": True,
+            "bpm": result["bpm"],
+            "time_signature": result["time_signature"],
+            "duration": result["duration"],
+            "key": result["key"],
+            "kick_recommendation": result["kick_recommendation"]
+        })
+        return line
+
+    async def stream_results():
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = [asyncio.ensure_future(analyze_entry(i, entry, semaphore)) for i, entry in enumerate(entries)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                line = await next_done
+                yield json.dumps(line) + "\n"
+        finally:
+            # Client disconnected: don't keep queued tracks waiting for a worker
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
 @app.post("/slice")
 async def slice_endpoint(
     filename: str, 
     bpm: float, 
     time_signature: str, 
     measures_per_slice: float = 1.0,
-    kick_offset: float = 0.0
+    kick_offset: float = 0.0,
+    kick_detector: str = "standard"
 ):
     try:
+        from audio_processor import get_kick_detector, slice_audio
+        from slice_index import describe_slices
+
         file_path = os.path.join(UPLOAD_DIR, filename)
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="File not found")
 
-        job_id = str(uuid.uuid4())
-        job_output_dir = os.path.join(OUTPUT_DIR, job_id)
-        os.makedirs(job_output_dir, exist_ok=True)
+        try:
+            get_kick_detector(kick_detector)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        check_slice_length(bpm, time_signature, [measures_per_slice])
 
         # Convert to float to handle 0.5
         measures_per_slice = float(measures_per_slice)
         kick_offset_seconds = float(kick_offset) / 1000.0  # Convert ms to seconds
 
-        slices = slice_audio(file_path, job_output_dir, bpm, time_signature, measures_per_slice, kick_offset_seconds)
-        
+        async def compute():
+            segments = []
+            async with admitted(estimate_file_memory(file_path, COPY_FACTORS["slice"])):
+                # Created only once admitted, so rejected requests leave no empty job behind
+                job_id = str(uuid.uuid4())
+                job_output_dir = os.path.join(OUTPUT_DIR, job_id)
+                os.makedirs(job_output_dir, exist_ok=True)
+
+                slices = await run_profiled(
+                    slice_audio, file_path, job_output_dir, bpm, time_signature, measures_per_slice,
+                    kick_offset_seconds, kick_detector, segments
+                )
+                # Described while still admitted, so only small vectors wait for the indexer
+                descriptors = await run_profiled(describe_slices, job_id, segments)
+            schedule_indexing(job_id, job_output_dir, descriptors)
+            
+            return {
+                "job_id": job_id,
+                "slices": slices
+            }
+
+        # Identical concurrent requests share one job
+        key = ("slice", file_identity(file_path), bpm, time_signature, measures_per_slice, kick_offset_seconds,
+               kick_detector)
+        return await single_flight.run(key, compute)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error slicing: {str(e)}")
+
+@app.post("/slice-sweep")
+async def slice_sweep_endpoint(
+    filename: str,
+    bpm: float,
+    time_signature: str,
+    measures_per_slice: List[float] = Query([1.0]),
+    kick_offset: List[float] = Query([0.0]),
+    write_files: bool = True,
+    kick_detector: str = "standard",
+    index_slices: bool = False
+):
+    """
+    Try every combination of measures_per_slice and kick_offset (ms) in one
+    request. The file is decoded and kicks are detected once; each combination
+    gets its own job_id when write_files is true, otherwise only the slice
+    manifests are returned.
+    
+    Sweep jobs are near-duplicates of each other, so they are only added to the
+    similarity index with index_slices=true.
+    """
+    try:
+        from audio_processor import get_kick_detector, slice_audio_sweep
+        from slice_index import describe_slices
+
+        file_path = os.path.join(UPLOAD_DIR, filename)
+        if not os.path.exists(file_path):
+            raise HTTPException(status_code=404, detail="File not found")
+
+        if len(measures_per_slice) * len(kick_offset) > MAX_SWEEP_COMBINATIONS:
+            raise HTTPException(status_code=400, detail=f"Too many combinations (max {MAX_SWEEP_COMBINATIONS})")
+
+        try:
+            get_kick_detector(kick_detector)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        check_slice_length(bpm, time_signature, measures_per_slice)
+
+        combinations = []
+        for measures in measures_per_slice:
+            for offset_ms in kick_offset:
+                job_id = str(uuid.uuid4()) if write_files else None
+                combinations.append({
+                    "job_id": job_id,
+                    "measures_per_slice": float(measures),
+                    "kick_offset": float(offset_ms),
+                    "output_dir": os.path.join(OUTPUT_DIR, job_id) if job_id else None,
+                    "segments": [] if job_id and index_slices else None
+                })
+
+        async with admitted(estimate_file_memory(file_path, COPY_FACTORS["slice"])):
+            # Created only once admitted, so rejected requests leave no empty jobs behind
+            for combo in combinations:
+                if combo["output_dir"]:
+                    os.makedirs(combo["output_dir"], exist_ok=True)
+
+            # kick_offset is sent in ms, the processor works in seconds
+            manifests = await run_profiled(
+                slice_audio_sweep, file_path, bpm, time_signature,
+                [{**combo, "kick_offset": combo["kick_offset"] / 1000.0} for combo in combinations],
+                kick_detector
+            )
+            # Described while still admitted, so only small vectors wait for the indexer
+            indexed = [combo for combo in combinations if combo["segments"] is not None]
+            for combo in indexed:
+                combo["descriptors"] = await run_profiled(describe_slices, combo["job_id"], combo.pop("segments"))
+        for combo in indexed:
+            schedule_indexing(combo["job_id"], combo["output_dir"], combo["descriptors"])
+
         return {
-            "job_id": job_id,
-            "slices": slices
+            "results": [
+                {
+                    "job_id": combo["job_id"],
+                    "measures_per_slice": combo["measures_per_slice"],
+                    "kick_offset": combo["kick_offset"],
+                    "slices": slices
+                }
+                for combo, slices in zip(combinations, manifests)
+            ]
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error slicing: {str(e)}")
 
 @app.get("/download/{job_id}/{filename}")
-async def download_slice(job_id: str, filename: str):
+async def download_slice(job_id: str, filename: str, v: Optional[str] = None,
+                         if_none_match: Optional[str] = Header(None)):
     file_path = os.path.join(OUTPUT_DIR, job_id, filename)
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(file_path)
+    # Other files in the job directory (kicks, remixes) can be regenerated in place
+    immutable = SLICE_FILENAME_PATTERN.match(filename) is not None
+    return await run_in_threadpool(cached_file_response, file_path, if_none_match, immutable, v)
 
 @app.post("/extract-kicks")
 async def extract_kicks_endpoint(
@@ -105,21 +481,31 @@ async def extract_kicks_endpoint(
         output_filename = filename.replace('.wav', '_kicks.wav')
         output_path = os.path.join(OUTPUT_DIR, job_id, output_filename)
         
-        # Extract and enhance kicks
-        extract_and_enhance_kicks(input_path, output_path, enhancement_level)
+        # Extract and enhance kicks. The version is hashed from what this computation
+        # wrote: a request with another enhancement_level writes the same output file
+        async def compute():
+            async with admitted(estimate_file_memory(input_path, COPY_FACTORS["extract_kicks"])):
+                return await run_profiled(extract_and_enhance_kicks, input_path, output_path, enhancement_level)
+        
+        kicks_version = await single_flight.run(("extract-kicks", file_identity(input_path), output_path, enhancement_level), compute)
         
         return {
             "success": True,
             "kicks_filename": output_filename,
+            "kicks_version": kicks_version,
             "message": f"Kicks extracted and enhanced at {enhancement_level}% intensity"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error extracting kicks: {str(e)}")
 
 @app.get("/download-kicks/{job_id}/{filename}")
-async def download_kicks(job_id: str, filename: str):
+async def download_kicks(job_id: str, filename: str, v: Optional[str] = None,
+                         if_none_match: Optional[str] = Header(None)):
     """
-    Download extracted kicks file
+    Download extracted kicks file.
+    Pass v=<kicks_version> from /extract-kicks for a cache-forever URL.
     """
     # Look for the kicks version
     kicks_filename = filename.replace('.wav', '_kicks.wav')
@@ -128,48 +514,369 @@ async def download_kicks(job_id: str, filename: str):
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="Kicks file not found")
     
-    return FileResponse(file_path)
+    return await run_in_threadpool(cached_file_response, file_path, if_none_match, False, v)
+
+def remix_filename(variant: int = 1, preview: bool = False) -> str:
+    """
+    Variant 1 keeps the historical ai_remix.wav name so /download-remix works unchanged.
+    """
+    base = "ai_remix" if variant <= 1 else f"ai_remix_{variant}"
+    return f"{base}_preview.wav" if preview else f"{base}.wav"
 
 @app.post("/ai-remix")
-async def ai_remix_endpoint(job_id: str, bpm: float):
+async def ai_remix_endpoint(
+    job_id: str,
+    bpm: float,
+    seed: Optional[int] = None,
+    variants: int = 1,
+    stream: bool = False,
+    borrow_slices: int = 0
+):
     """
     Generate an AI remix from all slices in a job.
     Analyzes slices, classifies them, and creates a musical structure.
+    
+    The same seed always produces the same remix. With variants=N, slices are
+    analyzed once and N distinct remixes are rendered concurrently. With
+    stream=true the response is NDJSON: a short preview line per variant
+    first, then one line per full render as it finishes.
+    
+    With borrow_slices=N, up to N similar slices per category are drawn from
+    other jobs through the similarity index.
     """
     try:
+        from ai_remixer import (generate_remix_variants, list_slice_files, new_seed, prepare_remix,
+                                render_preview, render_remix, variant_sequences)
+        from slice_index import borrow_similar_slices, describe_slices
+
         slices_dir = os.path.join(OUTPUT_DIR, job_id)
         if not os.path.exists(slices_dir):
             raise HTTPException(status_code=404, detail="Job not found")
         
-        # Output path for the remix
-        remix_filename = "ai_remix.wav"
-        remix_path = os.path.join(slices_dir, remix_filename)
+        if not 1 <= variants <= MAX_REMIX_VARIANTS:
+            raise HTTPException(status_code=400, detail=f"variants must be between 1 and {MAX_REMIX_VARIANTS}")
+        
+        # NumPy only seeds from non-negative integers
+        if seed is not None and seed < 0:
+            raise HTTPException(status_code=400, detail="seed must be a non-negative integer")
+        
+        requested_seed = seed
+        if seed is None:
+            seed = new_seed()
+        
+        slice_paths = [os.path.join(slices_dir, f) for f in await run_in_threadpool(list_slice_files, slices_dir)]
+        
+        # Decoded slices plus one rendered copy per variant (one header read per slice, off the event loop)
+        remix_bytes = await run_in_threadpool(estimate_files_memory, slice_paths, COPY_FACTORS["ai_remix"] + variants)
         
-        # Generate the remix
-        success, sequence, categories = generate_ai_remix(slices_dir, bpm, remix_path)
+        output_paths = [os.path.join(slices_dir, remix_filename(k)) for k in range(1, variants + 1)]
         
-        if not success:
-            raise HTTPException(status_code=500, detail="Failed to generate remix")
+        async def prepare():
+            # Analyze and decode slices once for every variant
+            slices, sample_rate, categories = await run_profiled(prepare_remix, slices_dir)
+            if not slices:
+                raise HTTPException(status_code=500, detail="Failed to generate remix")
+            
+            # Jobs sliced before indexing existed get their slices indexed for /similar
+            slice_files = [os.path.basename(path) for path in slice_paths]
+            descriptors = await run_profiled(
+                describe_slices, job_id, [(name, y, sample_rate) for name, y in zip(slice_files, slices)], True
+            )
+            schedule_indexing(job_id, slices_dir, descriptors, only_missing=True)
+            
+            borrowed = []
+            if borrow_slices > 0:
+                borrowed = await run_profiled(
+                    borrow_similar_slices, job_id, slices, sample_rate, categories, borrow_slices, OUTPUT_DIR,
+                    slice_files
+                )
+            return slices, sample_rate, categories, borrowed
         
+        async def compute():
+            async with admitted(remix_bytes):
+                slices, sample_rate, categories, borrowed = await prepare()
+                results = await run_profiled(
+                    generate_remix_variants, slices, sample_rate, categories, bpm, seed, output_paths
+                )
+            
+            if not any(r["success"] for r in results):
+                raise HTTPException(status_code=500, detail="Failed to generate remix")
+            
+            if variants == 1:
+                return {
+                    "success": True,
+                    "remix_filename": remix_filename(),
+                    "remix_version": results[0]["remix_version"],
+                    "seed": seed,
+                    "sequence": results[0]["sequence"],
+                    "categories": categories,
+                    "borrowed_slices": borrowed,
+                    "message": "AI Remix generated successfully!"
+                }
+            
+            for r in results:
+                r["remix_filename"] = remix_filename(r["variant"])
+            
+            return {
+                "success": all(r["success"] for r in results),
+                "seed": seed,
+                "categories": categories,
+                "borrowed_slices": borrowed,
+                "variants": results,
+                "message": f"{variants} AI Remixes generated successfully!"
+            }
+        
+        if not stream:
+            # Identical concurrent requests (same seed, or both unseeded) share one render
+            key = ("ai-remix", job_id, bpm, requested_seed, variants, borrow_slices,
+                   tuple(file_identity(path) for path in slice_paths))
+            return await single_flight.run(key, compute)
+        
+        async with admitted(remix_bytes):
+            slices, sample_rate, categories, borrowed = await prepare()
+        
+        sequences = variant_sequences(categories, bpm, seed, variants)
+        
+        async def stream_variants():
+            loop = asyncio.get_running_loop()
+            yield json.dumps({"type": "analysis", "seed": seed, "categories": categories,
+                              "borrowed_slices": borrowed}) + "\n"
+            
+            # Rendering happens after the handler returned, so it needs its own reservation
+            try:
+                async with admission_controller.admit(remix_bytes):
+                    async for line in render_variants(loop):
+                        yield line
+            except AdmissionRejected as e:
+                yield json.dumps({"type": "error", "error": e.detail, "retry_after": e.retry_after}) + "\n"
+        
+        async def render_variants(loop):
+            # Previews are short and decimated, so they go out first
+            for k, sequence in enumerate(sequences, start=1):
+                preview_path = os.path.join(slices_dir, remix_filename(k, preview=True))
+                success = await loop.run_in_executor(
+                    None, render_preview, sequence, slices, sample_rate, preview_path
+                )
+                yield json.dumps({
+                    "type": "preview",
+                    "variant": k,
+                    "success": success,
+                    "preview_filename": remix_filename(k, preview=True),
+                    "sequence": sequence
+                }) + "\n"
+            
+            async def render_variant(k, sequence, output_path):
+                version = await loop.run_in_executor(
+                    None, lambda: render_remix(sequence, slices_dir, output_path, slices=slices, sample_rate=sample_rate)
+                )
+                return k, version
+            
+            tasks = [asyncio.ensure_future(render_variant(k, sequence, output_path))
+                     for k, (sequence, output_path) in enumerate(zip(sequences, output_paths), start=1)]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    k, version = await next_done
+                    yield json.dumps({
+                        "type": "render",
+                        "variant": k,
+                        "success": version is not None,
+                        "remix_filename": remix_filename(k),
+                        "remix_version": version
+                    }) + "\n"
+            finally:
+                for task in tasks:
+                    task.cancel()
+        
+        return StreamingResponse(stream_variants(), media_type="application/x-ndjson")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generating remix: {str(e)}")
+
+@app.get("/similar")
+async def similar_slices_endpoint(
+    job_id: str,
+    filename: str,
+    k: int = 10,
+    exclude_same_job: bool = False
+):
+    """
+    Find the slices most similar to a given slice across every indexed job.
+    """
+    try:
+        from slice_index import find_similar_slices
+
+        if not 1 <= k <= 100:
+            raise HTTPException(status_code=400, detail="k must be between 1 and 100")
+
+        # Loading the index, describing an unindexed slice and the scan are all blocking
+        matches = await run_in_threadpool(find_similar_slices, job_id, filename, k, exclude_same_job, OUTPUT_DIR)
+        if matches is None:
+            raise HTTPException(status_code=404, detail="Slice not found")
+
         return {
-            "success": True,
-            "remix_filename": remix_filename,
-            "sequence": sequence,
-            "categories": categories,
-            "message": "AI Remix generated successfully!"
+            "job_id": job_id,
+            "filename": filename,
+            "matches": matches
         }
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generating remix: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error searching similar slices: {str(e)}")
 
 @app.get("/download-remix/{job_id}")
-async def download_remix(job_id: str):
+async def download_remix(job_id: str, variant: int = 1, v: Optional[str] = None,
+                         if_none_match: Optional[str] = Header(None)):
     """
-    Download the generated AI remix
+    Download the generated AI remix.
+    Pass v=<remix_version> from /ai-remix for a cache-forever URL.
     """
-    file_path = os.path.join(OUTPUT_DIR, job_id, "ai_remix.wav")
+    file_path = os.path.join(OUTPUT_DIR, job_id, remix_filename(variant))
     
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="Remix not found. Generate it first using /ai-remix")
     
-    return FileResponse(file_path)
+    return await run_in_threadpool(cached_file_response, file_path, if_none_match, False, v)
+
+
+@app.post("/render-effects")
+async def render_effects_endpoint(
+    job_id: str,
+    filenames: List[str] = Query([]),
+    recordings: List[UploadFile] = File(None),
+    filter_type: str = "lowpass",
+    filter_frequency: float = 20000.0,
+    filter_resonance: float = 1.0,
+    delay_time: float = 0.25,
+    delay_feedback: float = 0.4,
+    delay_mix: float = 0.3,
+    reverb_mix: float = 0.3,
+    compressor_threshold_db: float = 0.0,
+    compressor_ratio: float = 1.0,
+    master_volume: float = 1.0,
+    bypass: bool = False,
+    tail_seconds: float = 0.0
+):
+    """
+    Render slices, the AI remix or uploaded recordings through the master
+    effects chain on the server. Each file is saved as <name>_fx.wav in the job.
+    """
+    try:
+        from effects_processor import normalize_effects_settings, render_effects_batch, validate_tail_seconds
+
+        if not JOB_ID_PATTERN.match(job_id):
+            raise HTTPException(status_code=400, detail="Invalid job_id")
+        job_dir = os.path.join(OUTPUT_DIR, job_id)
+        if not os.path.isdir(job_dir):
+            raise HTTPException(status_code=404, detail="Job not found")
+
+        settings = {
+            "filter_type": filter_type,
+            "filter_frequency": filter_frequency,
+            "filter_resonance": filter_resonance,
+            "delay_time": delay_time,
+            "delay_feedback": delay_feedback,
+            "delay_mix": delay_mix,
+            "reverb_mix": reverb_mix,
+            "compressor_threshold_db": compressor_threshold_db,
+            "compressor_ratio": compressor_ratio,
+            "master_volume": master_volume,
+            "bypass": bypass,
+        }
+
+        # Reject bad settings before any recording is written
+        try:
+            settings = normalize_effects_settings(settings)
+            tail_seconds = validate_tail_seconds(tail_seconds)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        for recording in recordings or []:
+            file_ext = os.path.splitext(recording.filename or "")[1].lower() or ".wav"
+            if file_ext not in RECORDING_EXTENSIONS:
+                raise HTTPException(status_code=400, detail=f"Unsupported recording format: {file_ext}")
+
+        sources = []
+        for filename in filenames:
+            input_path = os.path.join(job_dir, os.path.basename(filename))
+            if not os.path.exists(input_path):
+                raise HTTPException(status_code=404, detail=f"File not found: {filename}")
+            sources.append(input_path)
+
+        # Recordings are stored in the job so they can be downloaded like slices
+        for recording in recordings or []:
+            file_ext = os.path.splitext(recording.filename or "")[1].lower() or ".wav"
+            input_path = os.path.join(job_dir, f"recording_{uuid.uuid4().hex[:8]}{file_ext}")
+            await run_in_threadpool(save_upload, recording, input_path)
+            sources.append(input_path)
+
+        if not sources:
+            raise HTTPException(status_code=400, detail="No files to render")
 
+        jobs = [
+            {
+                "input_path": path,
+                "output_path": os.path.join(job_dir, os.path.splitext(os.path.basename(path))[0] + "_fx.wav"),
+            }
+            for path in sources
+        ]
+
+        # Block processing keeps memory per file roughly constant
+        async with admitted(EFFECTS_RENDER_BYTES * min(len(jobs), MAX_WORKERS)):
+            results = await run_profiled(render_effects_batch, jobs, settings, tail_seconds=tail_seconds)
+
+        return {
+            "success": all(r["success"] for r in results),
+            "results": results
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error rendering effects: {str(e)}")
+
+@app.get("/admission")
+async def admission_stats():
+    """
+    Memory budget usage and queue depth of the admission controller,
+    plus how many duplicate requests were coalesced
+    """
+    stats = admission_controller.stats()
+    stats["single_flight"] = single_flight.stats()
+    return stats
+
+def check_diagnostics_access(request: Request):
+    """
+    Diagnostics need profiling enabled and, when DSAMPLER_PROFILING_TOKEN is set,
+    that token in the X-Profile header or ?profile= query param.
+    """
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    token = request.headers.get(PROFILE_HEADER) or request.query_params.get(PROFILE_QUERY_PARAM)
+    if not diagnostics_authorized(token):
+        raise HTTPException(status_code=403, detail="Invalid profiling token")
+
+@app.get("/diagnostics")
+async def list_diagnostics(request: Request):
+    """
+    Stored request profiles, newest first
+    """
+    check_diagnostics_access(request)
+    return {"profiles": await run_in_threadpool(list_profiles)}
+
+@app.get("/diagnostics/{profile_id}/{kind}")
+async def download_diagnostics(profile_id: str, kind: str, request: Request):
+    """
+    Download a stored profile: kind is trace (Chrome trace-event JSON, for
+    chrome://tracing or Perfetto), pstats (cProfile data) or summary
+    """
+    check_diagnostics_access(request)
+    if kind not in PROFILE_FILES:
+        raise HTTPException(status_code=400, detail=f"kind must be one of {', '.join(PROFILE_FILES)}")
+    
+    output_dir = profile_dir(profile_id)
+    file_name, media_type = PROFILE_FILES[kind]
+    if output_dir is None or not os.path.exists(os.path.join(output_dir, PROFILE_FILES["summary"][0])):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    
+    return FileResponse(os.path.join(output_dir, file_name), media_type=media_type,
+                        filename=f"{profile_id}_{file_name}")
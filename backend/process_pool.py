@@ -0,0 +1,48 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from warmup import warm_up_worker
+
+# Shared worker processes for CPU-heavy endpoints
+MAX_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Return the shared process pool, creating it on first use.
+    Each worker warms up (imports, filter designs) before its first task.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS, initializer=warm_up_worker)
+        return _pool
+
+
+def reset_process_pool(broken: ProcessPoolExecutor) -> ProcessPoolExecutor:
+    """
+    Replace a pool whose workers died (e.g. a crash inside a native decoder)
+    so the next submissions do not fail with BrokenProcessPool.
+
+    Every task that was running on the broken pool fails at once, so many
+    callers may report the same pool: only the first replaces it, later
+    calls get the replacement instead of shutting it down.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+    return get_process_pool()
+
+
+def shutdown_process_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
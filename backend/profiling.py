@@ -0,0 +1,303 @@
+import cProfile
+import json
+import os
+import pstats
+import re
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+from file_utils import atomic_output
+
+# Profiling is opt-in per request and only honoured when enabled here
+PROFILING_ENABLED = os.environ.get("DSAMPLER_PROFILING", "0") == "1"
+# When set, the request flag must carry this token instead of "1"
+PROFILING_TOKEN = os.environ.get("DSAMPLER_PROFILING_TOKEN", "")
+DIAGNOSTICS_DIR = os.environ.get("DSAMPLER_DIAGNOSTICS_DIR", "diagnostics")
+# Older profiles are deleted beyond this many
+MAX_PROFILES = int(os.environ.get("DSAMPLER_PROFILE_RETENTION", 20))
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_QUERY_PARAM = "profile"
+
+PROFILE_FILES = {
+    "trace": ("trace.json", "application/json"),
+    "pstats": ("profile.pstats", "application/octet-stream"),
+    "summary": ("summary.json", "application/json"),
+}
+
+PROFILE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+_current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("current_profile", default=None)
+
+
+def profiling_requested(flag: Optional[str]) -> bool:
+    """
+    Whether a request's profile flag (header or query param value) turns profiling on.
+    """
+    if not PROFILING_ENABLED or not flag:
+        return False
+    if PROFILING_TOKEN:
+        return flag == PROFILING_TOKEN
+    return flag.lower() in ("1", "true", "yes")
+
+
+def diagnostics_authorized(token: Optional[str]) -> bool:
+    """
+    Whether stored profiles may be listed or downloaded. They expose source
+    paths and timings, so they are guarded by the same token as profiling.
+    """
+    if not PROFILING_ENABLED:
+        return False
+    return not PROFILING_TOKEN or token == PROFILING_TOKEN
+
+
+class RequestProfile:
+    """
+    Stage spans and cProfile data collected for one request. Spans can be
+    recorded from any thread the request's context reaches.
+    """
+
+    def __init__(self, method: str, path: str):
+        self.profile_id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.created_at = datetime.now().isoformat(timespec="seconds")
+        self.start = time.perf_counter()
+        self.request_thread = threading.get_ident()
+        self.end = None
+        self.status_code = None
+        self.spans = []
+        self.thread_names = {}
+        self._profilers = []
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, start: float, end: float, args: Optional[Dict] = None):
+        thread = threading.current_thread()
+        with self._lock:
+            self.thread_names[thread.ident] = thread.name
+            self.spans.append((name, start, end, thread.ident, args or {}))
+
+    def add_profiler(self, profiler: cProfile.Profile):
+        with self._lock:
+            self._profilers.append(profiler)
+
+    def finish(self, status_code: int):
+        self.end = time.perf_counter()
+        self.status_code = status_code
+
+    def chrome_trace(self) -> Dict:
+        """
+        Trace-event JSON for chrome://tracing or Perfetto.
+        """
+        pid = os.getpid()
+        events = [{
+            "name": f"{self.method} {self.path}",
+            "cat": "request",
+            "ph": "X",
+            "ts": 0,
+            "dur": round((self.end - self.start) * 1e6, 1),
+            "pid": pid,
+            "tid": self.request_thread,
+            "args": {"status_code": self.status_code},
+        }]
+        for name, start, end, tid, args in self.spans:
+            events.append({
+                "name": name,
+                "cat": "stage",
+                "ph": "X",
+                "ts": round((start - self.start) * 1e6, 1),
+                "dur": round((end - start) * 1e6, 1),
+                "pid": pid,
+                "tid": tid,
+                "args": args,
+            })
+        for tid, thread_name in self.thread_names.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread_name}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def stats(self) -> pstats.Stats:
+        """
+        cProfile data of all profiled stages, merged across threads.
+        """
+        stats = pstats.Stats()
+        for profiler in self._profilers:
+            stats.add(profiler)
+        return stats
+
+    def summary(self, stats: pstats.Stats, top: int = 25) -> Dict:
+        stages = {}
+        for name, start, end, _, _ in self.spans:
+            stages[name] = stages.get(name, 0.0) + (end - start)
+
+        functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+        return {
+            "profile_id": self.profile_id,
+            "method": self.method,
+            "path": self.path,
+            "status_code": self.status_code,
+            "created_at": self.created_at,
+            "duration_seconds": self.end - self.start,
+            "stage_seconds": stages,
+            "top_cumulative": [
+                {
+                    "function": f"{filename}:{line}({func})",
+                    "calls": calls,
+                    "total_seconds": total,
+                    "cumulative_seconds": cumulative,
+                }
+                for (filename, line, func), (_, calls, total, cumulative, _) in functions
+            ],
+        }
+
+
+def start_profile(method: str, path: str):
+    """
+    Start profiling the current request. Work in this context (and in
+    threadpool calls made through run_profiled) is attributed to it.
+
+    Returns:
+        (profile, token) - pass the token to stop_profile
+    """
+    profile = RequestProfile(method, path)
+    return profile, _current_profile.set(profile)
+
+
+def stop_profile(token):
+    """
+    Stop attributing work in this context to the profile. Tasks and threads
+    started meanwhile keep their copy of the context.
+    """
+    _current_profile.reset(token)
+
+
+def current_profile() -> Optional[RequestProfile]:
+    return _current_profile.get()
+
+
+@contextmanager
+def span(name: str, **args):
+    """
+    Record a stage of the current request's timeline. Costs one context
+    variable lookup when the request is not being profiled.
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_span(name, start, time.perf_counter(), args)
+
+
+def record_span(name: str, start: float, **args):
+    """
+    Record a stage that started at start (time.perf_counter()) and ends now.
+    """
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.add_span(name, start, time.perf_counter(), args)
+
+
+def call_profiled(func, *args, **kwargs):
+    """
+    Run func as a stage of the current request, under cProfile when the
+    request is being profiled. Meant for the worker thread of a
+    threadpool call.
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        return func(*args, **kwargs)
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already active (Python 3.12+ allows only one); keep the spans
+        profiler = None
+    try:
+        with span(getattr(func, "__name__", "call")):
+            return func(*args, **kwargs)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profile.add_profiler(profiler)
+
+
+async def run_profiled(func, *args, **kwargs):
+    """
+    run_in_threadpool for processing stages: the stage shows up in the
+    request's profile when one is being taken.
+    """
+    from fastapi.concurrency import run_in_threadpool
+
+    return await run_in_threadpool(call_profiled, func, *args, **kwargs)
+
+
+def profile_dir(profile_id: str) -> Optional[str]:
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    return os.path.join(DIAGNOSTICS_DIR, profile_id)
+
+
+def save_profile(profile: RequestProfile) -> str:
+    """
+    Write trace.json, profile.pstats and summary.json for a finished
+    request and prune old profiles.
+
+    Returns:
+        Directory the files were written to
+    """
+    output_dir = profile_dir(profile.profile_id)
+    os.makedirs(output_dir, exist_ok=True)
+
+    stats = profile.stats()
+    with atomic_output(os.path.join(output_dir, PROFILE_FILES["pstats"][0])) as temp_path:
+        stats.dump_stats(temp_path)
+    with atomic_output(os.path.join(output_dir, PROFILE_FILES["trace"][0])) as temp_path:
+        with open(temp_path, "w") as f:
+            json.dump(profile.chrome_trace(), f)
+    # Written last: its presence marks a complete profile
+    with atomic_output(os.path.join(output_dir, PROFILE_FILES["summary"][0])) as temp_path:
+        with open(temp_path, "w") as f:
+            json.dump(profile.summary(stats), f, indent=2)
+
+    prune_profiles()
+    return output_dir
+
+
+def list_profiles() -> List[Dict]:
+    """
+    Summaries of the stored profiles, newest first.
+    """
+    if not os.path.isdir(DIAGNOSTICS_DIR):
+        return []
+
+    profiles = []
+    for entry in os.listdir(DIAGNOSTICS_DIR):
+        summary_path = os.path.join(DIAGNOSTICS_DIR, entry, PROFILE_FILES["summary"][0])
+        if not PROFILE_ID_PATTERN.match(entry) or not os.path.exists(summary_path):
+            continue
+        try:
+            with open(summary_path) as f:
+                summary = json.load(f)
+        except (OSError, ValueError):
+            continue
+        profiles.append({key: summary[key] for key in
+                         ("profile_id", "method", "path", "status_code", "created_at", "duration_seconds")})
+    return sorted(profiles, key=lambda p: p["created_at"], reverse=True)
+
+
+def prune_profiles(keep: int = MAX_PROFILES):
+    if not os.path.isdir(DIAGNOSTICS_DIR):
+        return
+    entries = [os.path.join(DIAGNOSTICS_DIR, e) for e in os.listdir(DIAGNOSTICS_DIR) if PROFILE_ID_PATTERN.match(e)]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for path in entries[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
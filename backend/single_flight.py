@@ -0,0 +1,47 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+def file_identity(path: str) -> tuple:
+    """
+    Identity of a file's current content, cheap enough to build request keys:
+    a rewrite of the file changes its mtime or size.
+    """
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical requests: while a computation for a key is
+    running, later callers with the same key await its result instead of
+    starting their own. The key is forgotten as soon as the computation ends,
+    so later requests run fresh.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.coalesced_total = 0
+
+    async def run(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced_total += 1
+
+        # Shield so one caller disconnecting doesn't cancel the work for the others
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": len(self._inflight),
+            "coalesced_total": self.coalesced_total,
+        }
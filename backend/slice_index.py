@@ -0,0 +1,416 @@
+import numpy as np
+import soundfile as sf
+import scipy.signal
+import scipy.fft
+import json
+import os
+import threading
+from functools import lru_cache
+from typing import List, Dict, Optional, Tuple
+
+from ai_remixer import compute_slice_features, list_slice_files
+
+INDEX_DIR = "index"
+
+BASE_FEATURES = ["energy", "brightness", "onset_strength", "duration"]
+NUM_CHROMA = 12
+NUM_MFCC = 13
+NUM_MEL_BANDS = 26
+DESCRIPTOR_DIM = len(BASE_FEATURES) + NUM_CHROMA + NUM_MFCC
+
+# Rows scanned per step when searching, bounds temporary memory
+SEARCH_CHUNK_ROWS = 65536
+INITIAL_CAPACITY = 4096
+
+
+@lru_cache(maxsize=8)
+def _mel_filterbank(sr: int, n_fft: int) -> np.ndarray:
+    """
+    Triangular mel filterbank, shape (NUM_MEL_BANDS, n_fft // 2 + 1).
+    """
+    def hz_to_mel(f):
+        return 2595.0 * np.log10(1.0 + f / 700.0)
+
+    def mel_to_hz(m):
+        return 700.0 * (10 ** (m / 2595.0) - 1.0)
+
+    freqs = np.fft.rfftfreq(n_fft, 1 / sr)
+    mel_points = np.linspace(hz_to_mel(20.0), hz_to_mel(sr / 2), NUM_MEL_BANDS + 2)
+    hz_points = mel_to_hz(mel_points)
+
+    bank = np.zeros((NUM_MEL_BANDS, len(freqs)))
+    for i in range(NUM_MEL_BANDS):
+        left, center, right = hz_points[i], hz_points[i + 1], hz_points[i + 2]
+        rising = (freqs - left) / (center - left)
+        falling = (right - freqs) / (right - center)
+        bank[i] = np.maximum(0, np.minimum(rising, falling))
+    return bank
+
+
+def compute_slice_descriptor(y: np.ndarray, sr: int) -> np.ndarray:
+    """
+    Feature vector of a mono slice: the remixer features (energy, brightness,
+    onset strength, duration), a 12-bin chroma and 13 MFCC-style coefficients.
+    """
+    base = compute_slice_features(y, sr)
+
+    n_fft = 2048
+    freqs, psd = scipy.signal.welch(y, fs=sr, nperseg=min(n_fft, len(y)), nfft=n_fft)
+
+    # Chroma: fold 60-1000Hz energy into pitch classes (same range as detect_key)
+    chroma = np.zeros(NUM_CHROMA)
+    valid = (freqs > 60) & (freqs < 1000)
+    if np.any(valid):
+        midi = 12 * np.log2(freqs[valid] / 440.0) + 69
+        np.add.at(chroma, np.round(midi).astype(int) % 12, psd[valid])
+        total = chroma.sum()
+        if total > 0:
+            chroma /= total
+
+    # MFCC-style: log mel band energies, decorrelated with a DCT
+    mel_energy = _mel_filterbank(int(sr), n_fft) @ psd
+    mfcc = scipy.fft.dct(np.log(mel_energy + 1e-10), type=2, norm="ortho")[:NUM_MFCC]
+
+    return np.concatenate([
+        [base[name] for name in BASE_FEATURES],
+        chroma,
+        mfcc,
+    ]).astype(np.float32)
+
+
+class SliceIndex:
+    """
+    Persistent vector index over slice descriptors from every job.
+
+    Vectors live in a memory-mapped float32 file that grows by doubling;
+    slice identities are appended to a JSONL file. Running sums of the
+    vectors are kept so queries can standardize features without a full pass.
+    Intended for a single writer process.
+    """
+
+    def __init__(self, index_dir: str = INDEX_DIR):
+        self.index_dir = index_dir
+        self.vectors_path = os.path.join(index_dir, "vectors.f32")
+        self.meta_path = os.path.join(index_dir, "meta.jsonl")
+        self.state_path = os.path.join(index_dir, "state.json")
+        self._lock = threading.Lock()
+        os.makedirs(index_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        self.count = 0
+        self.capacity = INITIAL_CAPACITY
+        self.sum = np.zeros(DESCRIPTOR_DIM)
+        self.sum_sq = np.zeros(DESCRIPTOR_DIM)
+
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                state = json.load(f)
+            if state.get("dim") == DESCRIPTOR_DIM:
+                self.count = state["count"]
+                self.capacity = state["capacity"]
+                self.sum = np.array(state["sum"])
+                self.sum_sq = np.array(state["sum_sq"])
+            else:
+                print("Slice index descriptor changed, rebuilding from scratch")
+                for path in (self.vectors_path, self.meta_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+        self.meta = []
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.meta = [json.loads(line) for line in f if line.strip()]
+        # Drop rows written after the last saved state (e.g. a crash mid-update)
+        if len(self.meta) > self.count:
+            self.meta = self.meta[:self.count]
+            with open(self.meta_path, "w") as f:
+                for m in self.meta:
+                    f.write(json.dumps(m) + "\n")
+        self.rows = {(m["job_id"], m["filename"]): i for i, m in enumerate(self.meta)}
+        self._filter_arrays = None
+
+        self._open_vectors()
+
+    def _open_vectors(self):
+        size = self.capacity * DESCRIPTOR_DIM * 4
+        if not os.path.exists(self.vectors_path) or os.path.getsize(self.vectors_path) < size:
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(size)
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+",
+                                 shape=(self.capacity, DESCRIPTOR_DIM))
+
+    def _grow(self):
+        self.vectors.flush()
+        del self.vectors
+        self.capacity *= 2
+        self._open_vectors()
+
+    def _save_state(self, appended: List[Dict], rewrite_meta: bool):
+        self.vectors.flush()
+        # New slices are appended; the whole file is only rewritten when an existing row changed
+        with open(self.meta_path, "w" if rewrite_meta else "a") as f:
+            for m in (self.meta if rewrite_meta else appended):
+                f.write(json.dumps(m) + "\n")
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "dim": DESCRIPTOR_DIM,
+                "count": self.count,
+                "capacity": self.capacity,
+                "sum": self.sum.tolist(),
+                "sum_sq": self.sum_sq.tolist(),
+            }, f)
+        os.replace(tmp_path, self.state_path)
+
+    def add_many(self, entries: List[Tuple[str, str, int, np.ndarray]]):
+        """
+        Insert or update slices.
+
+        Args:
+            entries: List of (job_id, filename, sample_rate, descriptor)
+        """
+        with self._lock:
+            appended = []
+            rewrite_meta = False
+            for job_id, filename, sample_rate, vector in entries:
+                vector = np.asarray(vector, dtype=np.float32)
+                row = self.rows.get((job_id, filename))
+                if row is None:
+                    if self.count >= self.capacity:
+                        self._grow()
+                    row = self.count
+                    self.count += 1
+                    self.rows[(job_id, filename)] = row
+                    self.meta.append({"job_id": job_id, "filename": filename, "sample_rate": int(sample_rate)})
+                    appended.append(self.meta[-1])
+                else:
+                    old = self.vectors[row].astype(np.float64)
+                    self.sum -= old
+                    self.sum_sq -= old ** 2
+                    if self.meta[row]["sample_rate"] != int(sample_rate):
+                        self.meta[row]["sample_rate"] = int(sample_rate)
+                        rewrite_meta = True
+
+                self.vectors[row] = vector
+                self.sum += vector
+                self.sum_sq += vector.astype(np.float64) ** 2
+
+            self._filter_arrays = None
+            self._save_state(appended, rewrite_meta)
+
+    def get_vector(self, job_id: str, filename: str) -> Optional[np.ndarray]:
+        row = self.rows.get((job_id, filename))
+        if row is None:
+            return None
+        return np.array(self.vectors[row])
+
+    def _get_filter_arrays(self) -> Tuple[np.ndarray, np.ndarray, Dict[str, int]]:
+        # Per-row job codes and sample rates, so search filters are vectorized
+        if self._filter_arrays is None:
+            job_codes = {}
+            codes = np.array([job_codes.setdefault(m["job_id"], len(job_codes)) for m in self.meta], dtype=np.int64)
+            rates = np.array([m["sample_rate"] for m in self.meta], dtype=np.int64)
+            self._filter_arrays = (codes, rates, job_codes)
+        return self._filter_arrays
+
+    def _feature_weights(self) -> np.ndarray:
+        # Inverse variance so features with large units (brightness in Hz) don't dominate
+        if self.count == 0:
+            return np.ones(DESCRIPTOR_DIM, dtype=np.float32)
+        mean = self.sum / self.count
+        var = np.maximum(self.sum_sq / self.count - mean ** 2, 1e-12)
+        return (1.0 / var).astype(np.float32)
+
+    def search(self, query: np.ndarray, k: int = 10, exclude_job: Optional[str] = None,
+               sample_rate: Optional[int] = None) -> List[Dict]:
+        """
+        Top-k nearest slices by variance-weighted euclidean distance.
+
+        Args:
+            exclude_job: Skip slices from this job (e.g. the query's own job)
+            sample_rate: Only return slices with this sample rate
+
+        Returns:
+            List of {"job_id", "filename", "sample_rate", "distance"}, closest first
+        """
+        with self._lock:
+            count = self.count
+            weights = self._feature_weights()
+            meta = self.meta[:count]
+            vectors = self.vectors
+            codes, rates, job_codes = self._get_filter_arrays()
+
+        query = np.asarray(query, dtype=np.float32)
+        excluded = None
+        if exclude_job is not None or sample_rate is not None:
+            excluded = np.zeros(count, dtype=bool)
+            if exclude_job in job_codes:
+                excluded |= codes[:count] == job_codes[exclude_job]
+            if sample_rate is not None:
+                excluded |= rates[:count] != sample_rate
+
+        best_rows = np.empty(0, dtype=np.int64)
+        best_dist = np.empty(0, dtype=np.float32)
+        for start in range(0, count, SEARCH_CHUNK_ROWS):
+            end = min(start + SEARCH_CHUNK_ROWS, count)
+            diff = vectors[start:end] - query
+            dist = (diff * diff) @ weights
+            if excluded is not None:
+                dist[excluded[start:end]] = np.inf
+
+            take = min(k, len(dist))
+            top = np.argpartition(dist, take - 1)[:take]
+            best_rows = np.concatenate([best_rows, top + start])
+            best_dist = np.concatenate([best_dist, dist[top]])
+            if len(best_dist) > k:
+                keep = np.argpartition(best_dist, k - 1)[:k]
+                best_rows, best_dist = best_rows[keep], best_dist[keep]
+
+        order = np.argsort(best_dist)
+        return [
+            {**meta[best_rows[i]], "distance": float(np.sqrt(best_dist[i]))}
+            for i in order if np.isfinite(best_dist[i])
+        ]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_slice_index() -> SliceIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SliceIndex()
+    return _index
+
+
+def describe_slices(job_id: str, segments: List[Tuple[str, np.ndarray, int]],
+                    only_missing: bool = False) -> List[Tuple[str, int, np.ndarray]]:
+    """
+    Descriptors of already decoded slices, for index_job_slices. Meant to run
+    while the caller still holds the audio, so only these small vectors wait
+    for the indexer instead of the decoded samples.
+
+    Args:
+        segments: Decoded slices as (filename, samples, sample_rate)
+        only_missing: Skip slices that are already indexed
+
+    Returns:
+        List of (filename, sample_rate, descriptor)
+    """
+    index = get_slice_index()
+    descriptors = []
+    for slice_file, y, sr in segments:
+        if only_missing and index.get_vector(job_id, slice_file) is not None:
+            continue
+        if len(y.shape) > 1:
+            y = y.mean(axis=1)
+        descriptors.append((slice_file, sr, compute_slice_descriptor(y, sr)))
+    return descriptors
+
+
+def index_job_slices(job_id: str, slices_dir: str, descriptors: Optional[List[Tuple[str, int, np.ndarray]]] = None,
+                     only_missing: bool = False) -> int:
+    """
+    Add (or refresh) every slice of a job in the similarity index.
+
+    Args:
+        descriptors: (filename, sample_rate, descriptor) from describe_slices;
+                     without them the slice files are read one at a time
+        only_missing: Skip slices that are already indexed
+
+    Returns:
+        Number of slices indexed
+    """
+    index = get_slice_index()
+    if descriptors is None:
+        descriptors = []
+        for slice_file in list_slice_files(slices_dir):
+            if only_missing and index.get_vector(job_id, slice_file) is not None:
+                continue
+            y, sr = sf.read(os.path.join(slices_dir, slice_file))
+            descriptors.extend(describe_slices(job_id, [(slice_file, y, sr)]))
+
+    entries = [
+        (job_id, slice_file, sr, vector)
+        for slice_file, sr, vector in descriptors
+        if not (only_missing and index.get_vector(job_id, slice_file) is not None)
+    ]
+
+    if entries:
+        index.add_many(entries)
+    return len(entries)
+
+
+def find_similar_slices(job_id: str, filename: str, k: int = 10, exclude_same_job: bool = False,
+                        outputs_dir: str = "outputs") -> Optional[List[Dict]]:
+    """
+    The k indexed slices closest to a job's slice, excluding the slice itself.
+    A slice that isn't indexed yet is described from its file.
+
+    Returns:
+        Matches with a distance, or None if the slice doesn't exist
+    """
+    index = get_slice_index()
+    query = index.get_vector(job_id, filename)
+    if query is None:
+        # Not indexed yet (e.g. a job sliced before indexing existed)
+        slice_path = os.path.join(outputs_dir, job_id, os.path.basename(filename))
+        if not os.path.exists(slice_path):
+            return None
+        y, sr = sf.read(slice_path)
+        if len(y.shape) > 1:
+            y = y.mean(axis=1)
+        query = compute_slice_descriptor(y, sr)
+
+    # Ask for one extra match in case the slice itself is returned
+    matches = index.search(query, k + 1, exclude_job=job_id if exclude_same_job else None)
+    return [m for m in matches if (m["job_id"], m["filename"]) != (job_id, filename)][:k]
+
+
+def borrow_similar_slices(job_id: str, slices: List[np.ndarray], sample_rate: int, categories: Dict[str, List[int]],
+                          per_category: int = 2, outputs_dir: str = "outputs",
+                          slice_files: Optional[List[str]] = None) -> List[Dict]:
+    """
+    Extend a job's slices with the closest matches from other jobs.
+
+    For each category, the centroid of its slices' descriptors is looked up in
+    the index; matching slices (same sample rate) are decoded, appended to
+    `slices` and added to that category, so remix sequences can use them.
+    Descriptors already in the index are reused when slice_files (the names of
+    `slices`, in order) is given.
+
+    Returns:
+        List of {"slice_index", "job_id", "filename", "category"} for borrowed slices
+    """
+    index = get_slice_index()
+    names = slice_files or [None] * len(slices)
+    descriptors = []
+    for y, name in zip(slices, names):
+        vector = index.get_vector(job_id, name) if name else None
+        descriptors.append(vector if vector is not None else compute_slice_descriptor(y, sample_rate))
+    borrowed = []
+    seen = set()
+
+    for category, members in categories.items():
+        if not members:
+            continue
+        centroid = np.mean([descriptors[i] for i in members], axis=0)
+        for match in index.search(centroid, per_category, exclude_job=job_id, sample_rate=sample_rate):
+            key = (match["job_id"], match["filename"])
+            path = os.path.join(outputs_dir, match["job_id"], match["filename"])
+            if key in seen or not os.path.exists(path):
+                continue
+            seen.add(key)
+
+            y, _ = sf.read(path)
+            if len(y.shape) > 1:
+                y = y.mean(axis=1)
+            slices.append(y)
+            categories[category].append(len(slices) - 1)
+            borrowed.append({"slice_index": len(slices) - 1, "job_id": match["job_id"],
+                             "filename": match["filename"], "category": category})
+
+    return borrowed
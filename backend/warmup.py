@@ -0,0 +1,78 @@
+import importlib
+import os
+import time
+from typing import Dict
+
+# Set DSAMPLER_WARMUP=0 to skip warm-up (e.g. with uvicorn --reload during development)
+WARMUP_ENABLED = os.environ.get("DSAMPLER_WARMUP", "1") != "0"
+
+# Imported lazily by the endpoints, preloaded here so the first request doesn't pay for them
+HEAVY_MODULES = ["audio_processor", "ai_remixer", "kick_processor", "slice_index", "effects_processor"]
+
+
+def warm_up() -> Dict[str, float]:
+    """
+    Import the processing modules (SciPy, soundfile, pedalboard), prime the
+    filter-design cache and run the kick detector once on a short synthetic
+    signal so SciPy's lazily loaded submodules are in memory. A neutral effects
+    chain is rendered too, and checked to leave the level unchanged.
+
+    Returns:
+        Seconds spent on each step
+    """
+    timings = {}
+
+    start = time.perf_counter()
+    for module in HEAVY_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            print(f"Warm-up could not import {module}: {e}")
+    timings["imports"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    from filter_designs import prime_filter_designs
+    prime_filter_designs()
+    timings["filter_designs"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    import numpy as np
+    from audio_processor import detect_kick_onsets
+    sr = 44100
+    t = np.arange(sr) / sr
+    detect_kick_onsets(np.sin(2 * np.pi * 60 * t) * np.exp(-t * 10), sr)
+    timings["kick_detection"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    from effects_processor import NEUTRAL_GAIN_TOLERANCE_DB, neutral_chain_gain_db
+    gain_db = neutral_chain_gain_db(sr)
+    if abs(gain_db) > NEUTRAL_GAIN_TOLERANCE_DB:
+        print(f"Warning: neutral effects chain changes the level by {gain_db:+.2f} dB; renders won't match the browser")
+    timings["effects_chain"] = time.perf_counter() - start
+
+    return timings
+
+
+def warm_up_worker():
+    """
+    Process pool initializer: every worker warms up before taking tasks.
+    """
+    if WARMUP_ENABLED:
+        warm_up()
+
+
+def _worker_ready() -> int:
+    return os.getpid()
+
+
+def prime_process_pool(pool, workers: int) -> int:
+    """
+    Start every worker of a process pool ahead of traffic. Submitting one task
+    per worker makes the pool spawn all of them, and each runs warm_up_worker
+    as its initializer.
+
+    Returns:
+        Number of distinct worker processes that answered
+    """
+    futures = [pool.submit(_worker_ready) for _ in range(workers)]
+    return len({future.result() for future in futures})